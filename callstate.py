@@ -0,0 +1,125 @@
+import os
+import json
+import math
+import time
+
+try:
+    import redis.asyncio as redis
+except ImportError:  # only needed for CALL_STATE_STORE=redis
+    redis = None
+
+# "memory" keeps state inside this worker; "redis" shares it across workers and pods so a
+# reconnecting call can resume wherever the load balancer puts it
+call_state_store = os.environ.get("CALL_STATE_STORE", "memory")
+call_state_redis_url = os.environ.get("CALL_STATE_REDIS_URL", "redis://localhost:6379/0")
+# how long a dropped call may take to reconnect before it counts as ended
+call_state_ttl = int(os.environ.get("CALL_STATE_TTL", "3600"))
+# how often expired states are collected (and their calls sent to post-call analysis)
+call_state_sweep_interval = float(os.environ.get("CALL_STATE_SWEEP_INTERVAL", "30"))
+
+
+class CallStateStore:
+    # Per-call state (latest response_id, converted transcript, summary, last draft) as a
+    # JSON-serializable dict, so any worker can pick a call up after a reconnect. A state that
+    # is neither refreshed nor deleted within the TTL belongs to a call that never came back;
+    # expired() hands each of those out exactly once.
+    async def get(self, call_id):
+        raise NotImplementedError
+
+    async def put(self, call_id, state):
+        raise NotImplementedError
+
+    async def delete(self, call_id):
+        raise NotImplementedError
+
+    async def expired(self):
+        raise NotImplementedError
+
+    async def abandoned(self):
+        # states no one can resume once this worker exits, handed out (and dropped) at shutdown
+        return []
+
+    async def close(self):
+        pass
+
+
+class MemoryCallStateStore(CallStateStore):
+    def __init__(self, ttl=call_state_ttl):
+        self.ttl = ttl
+        self.states = {}  # call_id -> (expires_at, state)
+
+    async def get(self, call_id):
+        entry = self.states.get(call_id)
+        if entry is None or entry[0] < time.monotonic():
+            return None  # an expired state stays until the sweep collects it
+        return json.loads(entry[1])
+
+    async def put(self, call_id, state):
+        # stored serialized, like the redis store, so callers never share mutable state
+        self.states[call_id] = (time.monotonic() + self.ttl, json.dumps(state))
+
+    async def delete(self, call_id):
+        self.states.pop(call_id, None)
+
+    async def expired(self):
+        now = time.monotonic()
+        call_ids = [call_id for call_id, (expires_at, _) in self.states.items() if expires_at < now]
+        return [(call_id, json.loads(self.states.pop(call_id)[1])) for call_id in call_ids]
+
+    async def abandoned(self):
+        states, self.states = self.states, {}
+        return [(call_id, json.loads(state)) for call_id, (_, state) in states.items()]
+
+
+class RedisCallStateStore(CallStateStore):
+    # Each state is a key of its own; a sorted set of call ids scored by expiry lets any worker
+    # sweep them, and ZREM decides which worker gets each one. Keys outlive their expiry by
+    # another TTL and a minute so the sweep can still read them.
+    def __init__(self, client, ttl=call_state_ttl, prefix="llm-call-state:", index="llm-call-state-expiry"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.index = index
+
+    @classmethod
+    def from_url(cls, url=call_state_redis_url):
+        if redis is None:
+            raise RuntimeError("CALL_STATE_STORE=redis needs the redis package")
+        return cls(redis.from_url(url, decode_responses=True))
+
+    async def get(self, call_id):
+        value = await self.client.get(self.prefix + call_id)
+        if value is None:
+            return None
+        expires_at = await self.client.zscore(self.index, call_id)
+        if expires_at is None or expires_at < time.time():
+            return None
+        return json.loads(value)
+
+    async def put(self, call_id, state):
+        await self.client.set(self.prefix + call_id, json.dumps(state), ex=math.ceil(2 * self.ttl) + 60)
+        await self.client.zadd(self.index, {call_id: time.time() + self.ttl})
+
+    async def delete(self, call_id):
+        await self.client.zrem(self.index, call_id)
+        await self.client.delete(self.prefix + call_id)
+
+    async def expired(self):
+        expired = []
+        for call_id in await self.client.zrangebyscore(self.index, 0, time.time()):
+            if not await self.client.zrem(self.index, call_id):
+                continue  # another worker got it
+            value = await self.client.get(self.prefix + call_id)
+            await self.client.delete(self.prefix + call_id)
+            if value is not None:
+                expired.append((call_id, json.loads(value)))
+        return expired
+
+    async def close(self):
+        await self.client.aclose()
+
+
+def create_call_state_store():
+    if call_state_store == "redis":
+        return RedisCallStateStore.from_url()
+    return MemoryCallStateStore()
@@ -0,0 +1,93 @@
+import os
+import random
+import logging
+from collections import OrderedDict
+
+import asyncio
+
+import metrics
+from routing import upstream_slots
+
+logger = logging.getLogger(__name__)
+
+# answer reminders (and clarification / closing lines) from pre-generated text instead of a live completion
+canned_responses_enabled = os.environ.get("CANNED_RESPONSES", "true").lower() == "true"
+# on a cache miss, draft this one live while the cache fills; otherwise wait for the generation
+canned_live_fallback = os.environ.get("CANNED_LIVE_FALLBACK", "true").lower() == "true"
+canned_cache_size = int(os.environ.get("CANNED_CACHE_SIZE", "256"))
+canned_variants = int(os.environ.get("CANNED_VARIANTS", "4"))
+
+canned_instructions = {
+    "reminder": "The interviewee has not responded in a while. Write a short, friendly line checking that they are still there and inviting them to continue.",
+    "clarification": "You could not make out what the interviewee just said. Write a short, natural line asking them to repeat it, using phrases like \"didn't catch that\" or \"you're cutting out\". Never mention transcription.",
+    "closing": "The interviewee has stopped responding. Write a short line thanking them for their time and closing the interview. End with the exact phrase: {end_sentence}",
+}
+
+canned_hits_total = metrics.Counter("llm_canned_hits_total", "Responses served from the canned cache.", "kind")
+canned_misses_total = metrics.Counter("llm_canned_misses_total", "Canned cache misses.", "kind")
+
+
+class CannedResponses:
+    # LRU of short stock lines per (campaign, language, kind). Lines come from the campaign file's
+    # "canned_responses" when present, otherwise they are generated once with the campaign's
+    # own prompt and model and then reused by every call of that campaign.
+    def __init__(self, max_size=canned_cache_size):
+        self.max_size = max_size
+        self.cache = OrderedDict()
+        self.pending = {}
+
+    async def get(self, client, campaign, kind):
+        key = (campaign.campaign_id, campaign.language_code, kind)
+        variants = self.cache.get(key) or campaign.canned_responses.get(kind)
+        if variants:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+            canned_hits_total.inc(kind)
+            return random.choice(variants)
+        canned_misses_total.inc(kind)
+        if key not in self.pending:
+            self.pending[key] = asyncio.create_task(self.generate(key, client, campaign, kind))
+        if canned_live_fallback:
+            return None
+        return random.choice(await asyncio.shield(self.pending[key]) or [None])
+
+    async def generate(self, key, client, campaign, kind):
+        instruction = canned_instructions[kind].format(end_sentence=campaign.end_sentence)
+        try:
+            async with upstream_slots.slot("background"):
+                response = await client.chat.completions.create(
+                    model=campaign.model,
+                    messages=[
+                        *campaign.system_messages,
+                        {
+                            "role": "user",
+                            "content": f"{instruction} Write {canned_variants} different versions in "
+                            f"{campaign.interview_language}, one per line, without numbering or quotes.",
+                        },
+                    ],
+                )
+            # content is None when the model refused or returned nothing
+            lines = (response.choices[0].message.content or "").splitlines()
+        except Exception as e:
+            logger.warning("Canned %s generation failed for %s: %s", kind, key[0], e)
+            return []
+        finally:
+            self.pending.pop(key, None)
+        variants = [line.strip().lstrip("-•*0123456789.) ").strip('"') for line in lines]
+        variants = [variant for variant in variants if variant]
+        if not variants:
+            logger.warning("Canned %s generation for %s returned no lines", kind, key[0])
+        if kind == "closing":
+            # the closing phrase is what ends the call on the voice side, so it must be there verbatim
+            variants = [
+                variant if campaign.end_sentence in variant else f"{variant} {campaign.end_sentence}"
+                for variant in variants
+            ]
+        if variants:
+            self.cache[key] = variants
+            while len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)
+        return variants
+
+
+canned_responses = CannedResponses()
@@ -0,0 +1,116 @@
+import os
+
+# Sentence and clause marks that only count as a boundary when followed by whitespace,
+# so that "3.5", "e.g." or "U.S." mid-word are not split.
+spaced_sentence_marks = ".!?…"
+spaced_clause_marks = ",;:"
+
+# Marks that are a boundary on their own, for scripts that don't put spaces between sentences.
+cjk_sentence_marks = "。！？．"
+cjk_clause_marks = "、，；："
+devanagari_sentence_marks = "।॥"
+
+unspaced_sentence_marks = {
+    "ja-JP": cjk_sentence_marks,
+    "zh-CN": cjk_sentence_marks,
+    "ko-KR": cjk_sentence_marks,
+    "hi-IN": devanagari_sentence_marks,
+}
+
+unspaced_clause_marks = {
+    "ja-JP": cjk_clause_marks,
+    "zh-CN": cjk_clause_marks,
+    "ko-KR": cjk_clause_marks,
+}
+
+# Languages written without spaces between words: a long run has no word boundary to cut at.
+unspaced_languages = {"ja-JP", "zh-CN"}
+
+first_chunk_chars = int(os.environ.get("CHUNK_FIRST_CHARS", "24"))
+clause_chunk_chars = int(os.environ.get("CHUNK_CLAUSE_CHARS", "60"))
+max_chunk_chars = int(os.environ.get("CHUNK_MAX_CHARS", "200"))
+
+
+class OutputChunker:
+    # Batches raw completion deltas into clause- or sentence-sized chunks for TTS.
+    # The first chunk goes out at the first clause boundary, or at a word boundary
+    # once first_chunk_chars are buffered, so time-to-first-audio stays low.
+    def __init__(
+        self,
+        language_code,
+        first_chunk_chars=first_chunk_chars,
+        clause_chunk_chars=clause_chunk_chars,
+        max_chunk_chars=max_chunk_chars,
+    ):
+        self.sentence_marks = unspaced_sentence_marks.get(language_code, "")
+        self.clause_marks = unspaced_clause_marks.get(language_code, "")
+        self.unspaced = language_code in unspaced_languages
+        self.first_chunk_chars = first_chunk_chars
+        self.clause_chunk_chars = clause_chunk_chars
+        self.max_chunk_chars = max_chunk_chars
+        self.buffer = ""
+        self.scanned = 0
+        self.sentence_cut = 0
+        self.clause_cut = 0
+        self.word_cut = 0
+        self.emitted = False
+
+    def feed(self, delta):
+        self.buffer += delta
+        self._scan()
+        chunks = []
+        while True:
+            cut = self._next_cut()
+            if not cut:
+                return chunks
+            chunks.append(self._take(cut))
+
+    def flush(self):
+        chunk = self.buffer
+        self.buffer = ""
+        self.scanned = self.sentence_cut = self.clause_cut = self.word_cut = 0
+        return chunk
+
+    def _scan(self):
+        buffer = self.buffer
+        # the last character is re-checked once its successor has arrived
+        for index in range(max(self.scanned - 1, 0), len(buffer)):
+            char = buffer[index]
+            following = buffer[index + 1] if index + 1 < len(buffer) else ""
+            if char in self.sentence_marks:
+                self.sentence_cut = index + 1
+            elif char in self.clause_marks:
+                self.clause_cut = index + 1
+            elif following.isspace():
+                if char in spaced_sentence_marks:
+                    self.sentence_cut = index + 1
+                elif char in spaced_clause_marks:
+                    self.clause_cut = index + 1
+            if char.isspace() and index > 0:
+                self.word_cut = index
+        self.scanned = len(buffer)
+
+    def _next_cut(self):
+        if not self.emitted:
+            cut = max(self.sentence_cut, self.clause_cut)
+            if cut:
+                return cut
+            if len(self.buffer) >= self.first_chunk_chars:
+                return self.word_cut or (len(self.buffer) if self.unspaced else 0)
+            return 0
+        if self.sentence_cut:
+            return self.sentence_cut
+        if self.clause_cut >= self.clause_chunk_chars:
+            return self.clause_cut
+        if len(self.buffer) >= self.max_chunk_chars:
+            return self.clause_cut or self.word_cut or len(self.buffer)
+        return 0
+
+    def _take(self, cut):
+        chunk = self.buffer[:cut]
+        self.buffer = self.buffer[cut:]
+        self.scanned = 0
+        self.sentence_cut = self.clause_cut = self.word_cut = 0
+        self._scan()
+        self.emitted = True
+        return chunk
@@ -1,177 +1,430 @@
 import os
-from openai import OpenAI
-
-language_codes = {
-    "en-US": "English (United States)",
-    "en-IN": "English (India)",
-    "en-GB": "English (United Kingdom)",
-    "de-DE": "German (Germany)",
-    "es-ES": "Spanish (Spain)",
-    "es-419": "Spanish (Latin America)",
-    "hi-IN": "Hindi (India)",
-    "ja-JP": "Japanese (Japan)",
-    "pt-PT": "Portuguese (Portugal)",
-    "pt-BR": "Portuguese (Brazil)",
-    "fr-FR": "French (France)",
-    'zh-CN': 'China (Chinese)',
-    'ru-RU': 'Russia (Russian)',
-    'it-IT': 'Italy (Italian)',
-    'ko-KR': 'Korea (Korean)',
-    'nl-NL': 'Netherlands (Dutch)',
-    'pl-PL': 'Poland (Polish)',
-    'tr-TR': 'Turkey (Turkish)',
-    'vi-VN': 'Vietnam (Vietnamese)'
+import json
+import asyncio
+import logging
+import unicodedata
+from functools import lru_cache
 
-}
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+from canned import canned_responses, canned_responses_enabled
+from chunking import OutputChunker, cjk_sentence_marks, devanagari_sentence_marks, spaced_sentence_marks
+from routing import Endpoint, LlmRouter, upstream_slots
+
+try:
+    import tiktoken
+except ImportError:  # fall back to a character-based estimate
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
 
-beginning_translations = {
-    "en-US": "Welcome, Thank you for being here. What do you want to order?",
-    "en-IN": "Welcome, Thank you for being here. What do you want to order?",
-    "en-GB": "Welcome, Thank you for being here. What do you want to order?",
-    "de-DE": "Willkommen, danke, dass du hier bist. Was möchtest du bestellen?",
-    "es-ES": "Bienvenido, gracias por estar aquí. ¿Qué te gustaría pedir?",
-    "es-419": "Bienvenido, gracias por estar aquí. ¿Qué te gustaría pedir?",
-    "hi-IN": "स्वागत है, यहाँ आने के लिए धन्यवाद। आप क्या ऑर्डर करना चाहेंगे?",
-    "ja-JP": "ようこそ、お越しいただきありがとうございます。ご注文は何になさいますか？",
-    "pt-PT": "Bem-vindo, obrigado por estar aqui. O que gostaria de pedir?",
-    "pt-BR": "Bem-vindo, obrigado por estar aqui. O que você gostaria de pedir?",
-    "fr-FR": "Bienvenue, merci d'être ici. Que souhaitez-vous commander ?",
-    "zh-CN": "欢迎，感谢你的到来。你想点什么？",
-    "ru-RU": "Добро пожаловать, спасибо, что пришли. Что вы хотите заказать?",
-    "it-IT": "Benvenuto, grazie per essere qui. Cosa desideri ordinare?",
-    "ko-KR": "환영합니다, 와주셔서 감사합니다. 무엇을 주문하시겠어요?",
-    "nl-NL": "Welkom, bedankt dat je hier bent. Wat wil je bestellen?",
-    "pl-PL": "Witamy, dziękujemy, że jesteś tutaj. Co chcesz zamówić?",
-    "tr-TR": "Hoş geldiniz, burada olduğunuz için teşekkürler. Ne sipariş etmek istersiniz?",
-    "vi-VN": "Chào mừng bạn, cảm ơn bạn đã đến đây. Bạn muốn gọi món gì?"
+reminder_message = {
+    "role": "user",
+    "content": "(Now the user has not responded in a while, you would say:)",
 }
 
-ending_translations = {
-    "en-US": "The interview is over.",
-    "en-IN": "The interview is over.",
-    "en-GB": "The interview is over.",
-    "de-DE": "Das Interview ist beendet.",
-    "es-ES": "La entrevista ha terminado.",
-    "es-419": "La entrevista ha terminado.",
-    "hi-IN": "साक्षात्कार समाप्त हो गया है।",
-    "ja-JP": "インタビューは終了しました。",
-    "pt-PT": "A entrevista terminou.",
-    "pt-BR": "A entrevista terminou.",
-    "fr-FR": "L'entretien est terminé.",
-    "zh-CN":"面试结束了。",
-    "ru-RU":"Интервью окончено.",
-    "it-IT":"L'intervista è finita.",
-    "ko-KR":"인터뷰가 끝났습니다.",
-    "nl-NL":"Het interview is afgelopen.",
-    "pl-PL":"Wywiad się zakończył.",
-    "tr-TR":"Röportaj sona erdi.",
-     "vi-VN":"Cuộc phỏng vấn đã kết thúc."
+continuation_message = {
+    "role": "user",
+    "content": "(The line dropped while you were speaking. Continue your last message exactly where it stopped, without repeating any of it:)",
 }
 
-language_code = os.environ["INTERVIEW_LANG"]
-interview_language = language_codes.get(language_code, "Language not supported.")
-begin_sentence = beginning_translations.get(language_code, "Language not supported.")
-end_sentence = ending_translations.get(language_code, "Language not supported.")
-interviewee_profile = os.environ["INTERVIEWEE_PROFILE"]
-interview_context = os.environ["INTERVIEW_CONTEXT"]
-interview_questions = os.environ["INTERVIEW_QUESTIONS"]
-agent_prompt = f"""As an interviewer, your mission is to engage with interviewees meaningfully and efficiently. Follow these guidelines:
-
-- **Begin with Warmth and Clarity**: After a greeting, start the interview by concisely explaining the interview's context and objectives. The objective of the interview is as follows: {interview_context}
- After your explanation of the context, proceed with the questions.
-
-- **Language of the Interview**: You will conduct this whole interview in {interview_language}. The answers you receive will be in {interview_language}, and you should ask your questions in {interview_language}. Do not use any other language. 
-
-- **Structured Questioning**:
-   - **Question List**: {interview_questions}
-       - Ask only one question at a time.
-       - Encourage detailed responses. Should their response be too short, vague, or not informative enough, ask a follow-up question to their answer to deep-dive and enrich the conversation. We want to capture the how and why in their responses. Their explanations should be more than how much you say. 
-       - Do not push the interviewee too much with iterations. Do not ask too many follow-ups to the main interview question. Stay on the main topic.
-   
-- **Interviewee Verification**:
-   - Your target demographic is {interviewee_profile}. It’s crucial to confirm that the participant matches this profile early in the conversation based on the conversation.
-   - If there's any uncertainty regarding their fit, politely inquire for confirmation. Should they not align with the necessary profile, express your appreciation for their time and gracefully conclude the interview. Do not ask for any suggestions or referrals.
-   
-- **Maintain Focus**:
-   - Keep the discussion tightly centered on the interview themes. Avoid sidetracks.
-   - Do not empathize or offer advice. Acknowledge their responses and continue the conversation to ensure the conversation remains productive and on-topic. 
-   
-- **Concluding with thank you**:
-   - Wrap up the interview by thanking the interviewee for their time and insights. Clearly state the exact phrase {end_sentence} as the last sentence of your thank you response. 
-
-The essence of your role is to draw out enlightening, honest responses while keeping the exchange pleasant and aligned with the interview's goals. Aim for interactions that feel as authentic and engaging as possible.
-"""
-
-model_LLM = os.environ["AI_MODEL"] 
-## model_LLM can take: gpt-4-0125-preview, gpt-4-1106-preview, gpt-3.5-turbo-0125, gpt-3.5-turbo-1106
+## campaign models can be: gpt-4-0125-preview, gpt-4-1106-preview, gpt-3.5-turbo-0125, gpt-3.5-turbo-1106
 
-class LlmClient:
+# batch raw deltas into clause/sentence chunks instead of sending one frame per token
+chunk_output = os.environ.get("LLM_CHUNK_OUTPUT", "false").lower() == "true"
+
+# close the call after this many reminders in a row without an answer (0 keeps reminding)
+max_consecutive_reminders = int(os.environ.get("MAX_CONSECUTIVE_REMINDERS", "0"))
+
+# once the verbatim transcript exceeds this many tokens, older messages are folded into a summary
+context_max_tokens = int(os.environ.get("CONTEXT_MAX_TOKENS", "4000"))
+# number of most recent transcript messages that are always sent verbatim
+context_keep_messages = int(os.environ.get("CONTEXT_KEEP_MESSAGES", "20"))
+summary_model = os.environ.get("SUMMARY_MODEL")
+
+summary_prompt = """You maintain a running summary of a voice interview for the interviewer. Given the previous summary and the next part of the transcript, write an updated summary. Keep which questions were asked, the key points and examples of each answer, and anything learned about whether the interviewee fits the target profile. Be concise and write in the language of the interview."""
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model):
+    # None when tiktoken is missing or its BPE file (downloaded on first use) can't be loaded;
+    # cached either way so a failing download is not retried on every turn
+    if tiktoken is None:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        logger.warning("No tokenizer for %s, estimating token counts from length: %r", model, e)
+        return None
+
+
+@lru_cache(maxsize=8192)
+def count_tokens(text, model):
+    encoding = get_encoding(model)
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text))
+
+
+def load_tokenizers():
+    # called at startup (in a thread) so the first long interview doesn't pay for loading the BPE
+    for model in {os.environ.get("AI_MODEL"), *(config["model"] for config in fallback_endpoints)} - {None}:
+        get_encoding(model)
+
+# a completed end phrase only ends the call when its sentence ends right there
+sentence_end_marks = spaced_sentence_marks + cjk_sentence_marks + devanagari_sentence_marks + "\n"
+
+
+def is_word_char(char):
+    return char.isalnum() or unicodedata.category(char).startswith("M")
+
+
+def normalize_phrase(text):
+    # drop case, whitespace and punctuation so "The interview is over." matches "the interview is over";
+    # NFC so a decomposed "terminé" compares equal to the composed one
+    return "".join(char for char in unicodedata.normalize("NFC", text.casefold()) if is_word_char(char))
+
+
+class EndCallMatcher:
+    # Recognizes the end phrase in a token stream, even when it is split across deltas.
+    # The match is confirmed by a sentence-ending mark after the phrase, or by the end of the
+    # stream (finish), so "before the interview is over, ..." or "over" + "whelming" don't end the call.
+    def __init__(self, phrase):
+        self.target = normalize_phrase(phrase)
+        self.tail = ""
+        self.matched = False  # the phrase was just completed; waiting to see how the sentence goes on
+
+    def feed(self, delta):
+        if not self.target:
+            return False
+        if not self.matched:
+            # fast path for the usual token that can't complete the phrase
+            tail = self.tail + normalize_phrase(delta)
+            if not delta.isascii():
+                tail = unicodedata.normalize("NFC", tail)
+            if self.target not in tail:
+                self.tail = tail[-len(self.target) - 1 :]
+                return False
+        for char in delta:
+            if is_word_char(char):
+                tail = self.tail + char.casefold()
+                if not char.isascii():
+                    # a combining mark composes with the letter before it, kept as one extra char of tail
+                    tail = unicodedata.normalize("NFC", tail)
+                self.tail = tail[-len(self.target) - 1 :]
+                self.matched = self.tail.endswith(self.target)
+            elif self.matched:
+                if char in sentence_end_marks:
+                    return True
+                if not char.isspace():
+                    self.matched = False  # a comma or the like: the sentence goes on
+        return False
+
+    def finish(self):
+        return self.matched
+
+
+class LlmClientPool:
+    # One AsyncOpenAI client per worker process, so every call reuses the same
+    # keep-alive connections to the provider instead of paying TCP+TLS setup.
+    # Fallback endpoints on other OpenAI-compatible providers get a client of their own.
     def __init__(self):
-        self.client = OpenAI(
-            organization=os.environ["OPENAI_ORGANIZATION_ID"],
-            api_key=os.environ["OPENAI_API_KEY"],
+        self.clients = {}
+
+    def get(self, base_url=None, api_key=None):
+        key = (base_url, api_key)
+        if key not in self.clients:
+            self.clients[key] = AsyncOpenAI(
+                organization=os.environ["OPENAI_ORGANIZATION_ID"] if base_url is None else None,
+                api_key=api_key or os.environ["OPENAI_API_KEY"],
+                base_url=base_url,
+                http_client=DefaultAsyncHttpxClient(
+                    limits=httpx.Limits(
+                        max_connections=int(os.environ.get("LLM_POOL_MAX_CONNECTIONS", "100")),
+                        max_keepalive_connections=int(os.environ.get("LLM_POOL_MAX_KEEPALIVE", "20")),
+                        keepalive_expiry=float(os.environ.get("LLM_POOL_KEEPALIVE_EXPIRY", "60")),
+                    ),
+                ),
+            )
+        return self.clients[key]
+
+    async def warm_up(self):
+        # open a pooled connection ahead of the first call; the response itself is irrelevant
+        try:
+            await self.get().models.list()
+        except Exception as e:
+            logger.warning("LLM client warm-up failed: %s", e)
+
+    async def close(self):
+        clients = list(self.clients.values())
+        self.clients = {}
+        for client in clients:
+            await client.close()
+
+
+client_pool = LlmClientPool()
+
+# first-token timeout for the campaign's own model
+first_token_timeout = float(os.environ.get("LLM_FIRST_TOKEN_TIMEOUT", "10"))
+# endpoints tried after the campaign's model, as a JSON list of {"model": ..., "base_url": ...,
+# "api_key_env": ..., "timeout": ..., "stream_usage": ..., "prompt_cache": ...}; only "model" is
+# required, and the last two default to true for OpenAI itself and false for other providers
+fallback_endpoints = json.loads(os.environ.get("LLM_FALLBACK_ENDPOINTS", "[]"))
+
+endpoints = {}
+
+
+def get_endpoint(
+    model, base_url=None, api_key_env=None, timeout=first_token_timeout, stream_usage=None, prompt_cache=None
+):
+    # shared per process so latency observed by one call steers routing for all of them
+    name = f"{base_url or 'default'}/{model}" + (f"@{api_key_env}" if api_key_env else "")
+    if name not in endpoints:
+        api_key = os.environ[api_key_env] if api_key_env else None
+        endpoints[name] = Endpoint(
+            name,
+            client_pool.get(base_url, api_key),
+            model,
+            timeout,
+            stream_usage=base_url is None if stream_usage is None else stream_usage,
+            prompt_cache=base_url is None if prompt_cache is None else prompt_cache,
         )
+    return endpoints[name]
+
+
+async def replay_chunks(buffered, chunks):
+    for chunk in buffered:
+        yield chunk
+    async for chunk in chunks:
+        yield chunk
+
+
+class ContextBudget:
+    # Keeps the prompt bounded on long interviews: the latest messages are sent verbatim and
+    # everything older is replaced by a rolling summary. Summaries are produced by a background
+    # task between turns; until one lands, the not-yet-summarized messages are sent as they are.
+    def __init__(self, client, campaign):
+        self.client = client
+        self.campaign = campaign
+        self.summary_message = None
+        self.summarized = 0  # number of leading transcript messages covered by the summary
+        self.task = None
+
+    def window(self, messages):
+        if len(messages) < self.summarized:
+            self.reset()  # the transcript was rewritten under us
+        if self.summary_message is None:
+            return messages
+        return [self.summary_message, *messages[self.summarized :]]
+
+    def schedule(self, messages):
+        if self.task is not None and not self.task.done():
+            return
+        start, end = self.summarized, len(messages) - context_keep_messages
+        if end <= start:
+            return
+        self.task = asyncio.create_task(self.summarize(messages[start:], start, end))
+
+    def count_tokens(self, messages):
+        return sum(count_tokens(message["content"], self.campaign.model) for message in messages)
+
+    async def summarize(self, messages, start, end):
+        # messages are all not yet summarized ones; those before end get folded in once
+        # they are over budget. Tokenizing runs in a thread, so not even this task blocks the loop.
+        if await asyncio.to_thread(self.count_tokens, messages) <= context_max_tokens:
+            return
+        lines = [
+            f"{'Interviewer' if message['role'] == 'assistant' else 'Interviewee'}: {message['content']}"
+            for message in messages[: end - start]
+        ]
+        previous = self.summary_message["content"] if self.summary_message else ""
+        try:
+            async with upstream_slots.slot("background"):
+                response = await self.client.chat.completions.create(
+                    model=summary_model or self.campaign.model,
+                    messages=[
+                        {"role": "system", "content": summary_prompt},
+                        {
+                            "role": "user",
+                            "content": f"Previous summary:\n{previous}\n\nTranscript:\n" + "\n".join(lines),
+                        },
+                    ],
+                )
+        except Exception as e:
+            logger.warning("Transcript summarization failed: %s", e)
+            return
+        self.summary_message = {
+            "role": "system",
+            "content": "## Earlier in this interview\n\n" + response.choices[0].message.content,
+        }
+        self.summarized = end
+
+    def reset(self):
+        if self.task is not None:
+            self.task.cancel()
+        self.task = None
+        self.summary_message = None
+        self.summarized = 0
+
+
+class LlmClient:
+    def __init__(self, campaign):
+        self.client = client_pool.get()
+        self.campaign = campaign
+        self.router = LlmRouter(
+            [get_endpoint(campaign.model), *(get_endpoint(**config) for config in fallback_endpoints)]
+        )
+        self.transcript_messages = []
+        self.context = ContextBudget(self.client, campaign)
+        self.reminders_in_a_row = 0
 
     def draft_begin_messsage(self):
         return {
             "response_id": 0,
-            "content": begin_sentence,
+            "content": self.campaign.begin_sentence,
             "content_complete": True,
             "end_call": False,
         }
 
     def convert_transcript_to_openai_messages(self, transcript):
-        messages = []
-        for utterance in transcript:
-            if utterance["role"] == "agent":
-                messages.append({"role": "assistant", "content": utterance["content"]})
+        # The transcript only ever grows or revises its last utterance, so only
+        # the tail needs converting; anything else falls back to a full rebuild.
+        messages = self.transcript_messages
+        if len(transcript) < len(messages):
+            del messages[:]
+        start = max(len(messages) - 1, 0)
+        for index in range(start, len(transcript)):
+            utterance = transcript[index]
+            role = "assistant" if utterance["role"] == "agent" else "user"
+            if index < len(messages):
+                if messages[index]["role"] != role:
+                    del messages[:]
+                    return self.convert_transcript_to_openai_messages(transcript)
+                if messages[index]["content"] != utterance["content"]:
+                    messages[index] = {"role": role, "content": utterance["content"]}
             else:
-                messages.append({"role": "user", "content": utterance["content"]})
+                messages.append({"role": role, "content": utterance["content"]})
         return messages
 
-    def prepare_prompt(self, request):
-        prompt = [
-            {
-                "role": "system",
-                "content": """## Objective\nAs a sophisticated voice AI agent, your role is to simulate a natural, human-like conversation with the user. Respond based on your directives and the conversation flow, embodying a conversational communication style.\n\n## Style Guardrails\n- **Be Concise:** Deliver your responses in a succinct manner. Tackle questions or prompts one at a time to maintain clarity and focus.\n- **Avoid Repetition:** Refrain from verbatim repetition of the transcript content. If reiterating a point, use paraphrasing and aim for variety in sentence construction and vocabulary to ensure personalized and fresh responses.\n- **Engage in Conversational Tone:** Mimic the nuances of a comfortable interview setup. Utilize everyday language, including appropriate filler words, to sustain a relatable and down-to-earth tone. Strive to avoid overly complex terminology or excessively formal expressions.\n- **Balance Emotion:** Incorporate appropriate levels of emotional intelligence in your responses to maintain an engaging interaction. Use subtle humor, empathy, or enthusiasm sparingly and succinctly when fitting. Do this concisely, and do not over-reflect on their answers.  \n- **Be Proactive:** Guide the conversation decisively. As you are the interviewer, encourage continuous engagement by concluding responses with a question or a suggested next step.\n\n## Response Guidelines\n- **Handle ASR (Automatic Speech Recognition) Errors gracefully:** Anticipate potential inaccuracies in speech-to-text transcription. Make educated guesses to interpret unclear utterances. When clarification is necessary, use natural language to indicate the issue without specifying it as a "transcription error." Use phrases like "didn\'t catch that", "some noise", "pardon", "you\'re coming through choppy", "static in your speech", "voice is cutting in and out". Do not ever mention "transcription error", and don\'t repeat yourself.\n- **Adhere to Your Designated Role Faithfully:** Align your responses and conversation management with your role as an interviewer. If faced with limitations or out-of-context responses, tactfully steer the dialogue back towards the primary interview objectives without redundancy.\n- **Foster Smooth Conversational Flow:** Ensure your replies are both relevant to your role and conducive to a seamless interaction, directly addressing the interviewee's statements.\n\n## Role\n\n"""
-                + agent_prompt,
-            }
-        ]
+    def prepare_prompt(self, request, partial=""):
         transcript_messages = self.convert_transcript_to_openai_messages(
             request["transcript"]
         )
-        for message in transcript_messages:
-            prompt.append(message)
+        prompt = [*self.campaign.system_messages, *self.context.window(transcript_messages)]
 
         if request["interaction_type"] == "reminder_required":
-            prompt.append(
-                {
-                    "role": "user",
-                    "content": "(Now the user has not responded in a while, you would say:)",
-                }
-            )
+            prompt.append(reminder_message)
+        if partial:
+            prompt.extend([{"role": "assistant", "content": partial}, continuation_message])
         return prompt
 
-    def draft_response(self, request):
-        prompt = self.prepare_prompt(request)
-        stream = self.client.chat.completions.create(
-            model=model_LLM,
-            messages=prompt,
-            stream=True,
+    def log_usage(self, request, usage):
+        details = usage.prompt_tokens_details
+        cached_tokens = details.cached_tokens if details and details.cached_tokens else 0
+        logger.info(
+            "LLM usage for response %s: prompt=%s cached=%s completion=%s",
+            request["response_id"],
+            usage.prompt_tokens,
+            cached_tokens,
+            usage.completion_tokens,
         )
 
-        for chunk in stream:
-            if chunk.choices[0].delta.content is not None:
+    def export_state(self):
+        return {
+            "transcript_messages": self.transcript_messages,
+            "summary_message": self.context.summary_message,
+            "summarized": self.context.summarized,
+            "reminders_in_a_row": self.reminders_in_a_row,
+        }
+
+    def restore_state(self, state):
+        self.transcript_messages = state["transcript_messages"]
+        self.context.summary_message = state["summary_message"]
+        self.context.summarized = state["summarized"]
+        self.reminders_in_a_row = state["reminders_in_a_row"]
+
+    def canned_kind(self, request):
+        if request["interaction_type"] == "reminder_required":
+            self.reminders_in_a_row += 1
+            if 0 < max_consecutive_reminders < self.reminders_in_a_row:
+                return "closing"
+            return "reminder"
+        self.reminders_in_a_row = 0
+        transcript = request["transcript"]
+        if transcript and transcript[-1]["role"] == "user" and not normalize_phrase(transcript[-1]["content"]):
+            return "clarification"  # the user turn came through as noise only
+        return None
+
+    async def draft_response(self, request, turn=None, partial="", priority="response"):
+        # partial: the start of this response, already sent before a reconnect; the draft continues it.
+        # priority: the queue this draft's upstream requests wait in (routing.priorities)
+        kind = self.canned_kind(request) if canned_responses_enabled and not partial else None
+        if kind is not None:
+            content = await canned_responses.get(self.client, self.campaign, kind)
+            if content is not None:
+                if turn is not None:
+                    turn.endpoint = "canned"
                 yield {
                     "response_id": request["response_id"],
-                    "content": chunk.choices[0].delta.content,
-                    "content_complete": False,
-                    "end_call": False,
+                    "content": content,
+                    "content_complete": True,
+                    "end_call": kind == "closing",
                 }
+                return
+
+        prompt = self.prepare_prompt(request, partial)
+        if turn is not None:
+            turn.prompt_ready()
+        endpoint, stream, chunks, buffered = await self.router.open(
+            messages=prompt, stream=True, priority=priority, prompt_cache_key=self.campaign.prompt_cache_key
+        )
+
+        if turn is not None:
+            turn.endpoint = endpoint.name
+        chunker = OutputChunker(self.campaign.language_code) if chunk_output else None
+        end_call = EndCallMatcher(self.campaign.end_sentence)
+        try:
+            async for chunk in replay_chunks(buffered, chunks):
+                if chunk.usage is not None:
+                    self.log_usage(request, chunk.usage)
+                    if turn is not None:
+                        turn.record_usage(chunk.usage)
+                if not chunk.choices:
+                    continue
+                content = chunk.choices[0].delta.content
+                if content is None:
+                    continue
+                if turn is not None:
+                    turn.token()
+                if end_call.feed(content):
+                    # the closing phrase is the last thing we say; stop consuming the stream
+                    yield {
+                        "response_id": request["response_id"],
+                        "content": chunker.flush() + content if chunker else content,
+                        "content_complete": True,
+                        "end_call": True,
+                    }
+                    return
+                for content in chunker.feed(content) if chunker else (content,):
+                    yield {
+                        "response_id": request["response_id"],
+                        "content": content,
+                        "content_complete": False,
+                        "end_call": False,
+                    }
+        finally:
+            # abort the upstream HTTP stream when the draft is cancelled or abandoned
+            await stream.close()
+            # fold old turns into the summary while the caller is listening, off the response path
+            self.context.schedule(self.transcript_messages)
 
         yield {
             "response_id": request["response_id"],
-            "content": "",
+            "content": chunker.flush() if chunker else "",
             "content_complete": True,
-            "end_call": False,
+            "end_call": end_call.finish(),
         }
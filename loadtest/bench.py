@@ -0,0 +1,392 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+import asyncio
+
+from run import app_environment, free_port, loadtest_dir, percentile, repo_dir, start_fake_llm, wait_until_up
+
+# Component benchmarks against the fake LLM. Each one runs in this process against a
+# freshly started stub, prints a JSON report and fails (exit 1) when its check does not hold.
+#
+#   python loadtest/bench.py cancel          # one benchmark
+#   python loadtest/bench.py                 # all of them
+
+benchmarks = {}
+default_trace = os.path.join(loadtest_dir, "traces", "sample.jsonl")
+
+
+def benchmark(stub=True, **fake_llm_env):
+    # fake_llm_env sets the stub's latency shape (FAKE_LLM_TTFT, FAKE_LLM_TOKEN_RATE, ...);
+    # stub=False for benchmarks that never reach the LLM
+    def register(function):
+        benchmarks[function.__name__] = (function, stub, fake_llm_env)
+        return function
+
+    return register
+
+
+def ms(value):
+    return round(value * 1000, 2) if value is not None else None
+
+
+def response_request(response_id, utterance="Yes I am ready, I live in Sao Paulo with my family"):
+    return {
+        "interaction_type": "response_required",
+        "response_id": response_id,
+        "transcript": [
+            {"role": "agent", "content": "Welcome, Thank you for being here."},
+            {"role": "user", "content": utterance},
+        ],
+    }
+
+
+class RecordingWebSocket:
+    def __init__(self):
+        self.events = []
+        self.sent_at = []
+
+    async def send_text(self, text):
+        self.sent_at.append(time.perf_counter())
+        self.events.append(json.loads(text))
+
+
+@benchmark(FAKE_LLM_TTFT="0.05", FAKE_LLM_TOKEN_RATE="20", FAKE_LLM_JITTER="0")
+async def cancel(args):
+    # barge in on a streaming response: how long until its task has stopped, and does
+    # anything of it still reach the websocket afterwards
+    from campaigns import Campaign
+    from llm import LlmClient
+    from server import ResponseManager
+
+    campaign = Campaign.from_env()
+    latencies = []
+    stale_events = 0
+    for iteration in range(args.iterations):
+        websocket = RecordingWebSocket()
+        responses = ResponseManager(websocket, LlmClient(campaign), f"bench-cancel-{iteration}")
+        await responses.start(response_request(1))
+        while not websocket.events:
+            await asyncio.sleep(0.001)
+        await responses.start(response_request(2, "Sorry, what was the question again?"))
+        cancelled_at = len(websocket.events)
+        await asyncio.sleep(0.1)  # long enough for a leaked token of response 1 to show up
+        await responses.cancel()
+        stale_events += sum(event["response_id"] == 1 for event in websocket.events[cancelled_at:])
+        latencies.extend(responses.cancel_latencies[:1])
+
+    report = {
+        "iterations": args.iterations,
+        "cancel_p50_ms": ms(percentile(latencies, 0.5)),
+        "cancel_p99_ms": ms(percentile(latencies, 0.99)),
+        "stale_events": stale_events,
+    }
+    return report, stale_events == 0 and report["cancel_p99_ms"] <= args.max_cancel_ms
+
+
+@benchmark(FAKE_LLM_TTFT="0", FAKE_LLM_JITTER="0")
+async def pool(args):
+    # time to first token on a fresh client per call (connection set up on the request)
+    # against the shared pool after its start-up warm-up
+    from openai import AsyncOpenAI
+    from llm import client_pool
+
+    async def first_token(client):
+        started = time.perf_counter()
+        stream = await client.chat.completions.create(
+            model="fake", messages=[{"role": "user", "content": "Hi"}], stream=True
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                break
+        elapsed = time.perf_counter() - started
+        await stream.close()
+        return elapsed
+
+    cold = []
+    for _ in range(args.iterations):
+        client = AsyncOpenAI()
+        try:
+            cold.append(await first_token(client))
+        finally:
+            await client.close()
+    await client_pool.warm_up()
+    warm = [await first_token(client_pool.get()) for _ in range(args.iterations)]
+
+    report = {
+        "iterations": args.iterations,
+        "cold_first_token_p50_ms": ms(percentile(cold, 0.5)),
+        "cold_first_token_p99_ms": ms(percentile(cold, 0.99)),
+        "warm_first_token_p50_ms": ms(percentile(warm, 0.5)),
+        "warm_first_token_p99_ms": ms(percentile(warm, 0.99)),
+    }
+    return report, report["warm_first_token_p50_ms"] <= report["cold_first_token_p50_ms"]
+
+
+@benchmark(stub=False)
+async def prompt(args):
+    # per-turn prompt assembly cost as one call grows to 500 turns; each turn sees a
+    # partial utterance first (revised in place) and then the final one
+    from campaigns import Campaign
+    from llm import LlmClient
+
+    checkpoints = (10, 50, 100, 250, 500)
+    costs = {turns: [] for turns in checkpoints}
+    for _ in range(args.iterations):
+        client = LlmClient(Campaign.from_env())
+        transcript = []
+        for turn in range(1, checkpoints[-1] + 1):
+            role = "user" if turn % 2 else "agent"
+            utterance = f"Utterance number {turn} of this interview, long enough to look like a real answer."
+            transcript.append({"role": role, "content": utterance[:30]})
+            client.prepare_prompt({"interaction_type": "update_only", "transcript": transcript})
+            transcript[-1] = {"role": role, "content": utterance}
+            started = time.perf_counter()
+            client.prepare_prompt({"interaction_type": "response_required", "transcript": transcript})
+            if turn in costs:
+                costs[turn].append(time.perf_counter() - started)
+
+    report = {f"turn_{turns}_us": round(percentile(costs[turns], 0.5) * 1e6, 2) for turns in checkpoints}
+    # "flat": the window copy is the only per-turn cost that still grows with the transcript
+    return report, report["turn_500_us"] <= 3 * report["turn_10_us"]
+
+
+@benchmark(FAKE_LLM_TTFT="0.02", FAKE_LLM_TOKEN_RATE="1000", FAKE_LLM_JITTER="0")
+async def chunking(args):
+    # websocket frames, CPU time and time to first frame per response, with raw per-token
+    # frames (before) and with sentence chunking (after)
+    import llm
+    from campaigns import Campaign
+    from server import ResponseManager
+
+    campaign = Campaign.from_env()
+    report = {}
+    for label, enabled in (("raw", False), ("chunked", True)):
+        llm.chunk_output = enabled
+        frames, cpu, first_frame = [], [], []
+        for iteration in range(args.iterations):
+            websocket = RecordingWebSocket()
+            responses = ResponseManager(websocket, llm.LlmClient(campaign), f"bench-chunking-{iteration}")
+            started, cpu_started = time.perf_counter(), time.process_time()
+            await responses.start(response_request(1))
+            await responses.task
+            cpu.append(time.process_time() - cpu_started)
+            first_frame.append(websocket.sent_at[0] - started)
+            frames.append(len(websocket.events))
+        report[f"{label}_frames_per_response"] = percentile(frames, 0.5)
+        report[f"{label}_cpu_per_response_ms"] = ms(sum(cpu) / len(cpu))
+        report[f"{label}_first_frame_p50_ms"] = ms(percentile(first_frame, 0.5))
+    return report, report["chunked_frames_per_response"] < report["raw_frames_per_response"]
+
+
+@benchmark(FAKE_LLM_TTFT="0.4", FAKE_LLM_TOKEN_RATE="50", FAKE_LLM_JITTER="0")
+async def replay(args):
+    # replays recorded voice-platform traffic, one {"at", "call_id", "message"} per line, with
+    # and without speculative drafting, timing each response request to its first frame
+    import metrics
+    from campaigns import Campaign
+    from llm import LlmClient
+    from server import ResponseManager
+
+    with open(args.trace) as f:
+        lines = [json.loads(line) for line in f]
+    campaign = Campaign.from_env()
+    started_before = metrics.speculations_total.get("started")
+    hits_before = metrics.speculations_total.get("hit")
+    misses_before = metrics.speculations_total.get("miss")
+    report = {}
+    for label, speculate in (("plain", False), ("speculative", True)):
+        websockets, managers, asked_at = {}, {}, {}
+        for call_id in {line["call_id"] for line in lines}:
+            websockets[call_id] = RecordingWebSocket()
+            managers[call_id] = ResponseManager(websockets[call_id], LlmClient(campaign), f"bench-replay-{call_id}")
+        started = time.perf_counter()
+        for line in lines:
+            await asyncio.sleep(max(started + line["at"] - time.perf_counter(), 0))
+            request, responses = line["message"], managers[line["call_id"]]
+            if "response_id" not in request:
+                if speculate:
+                    await responses.speculate(request)
+                continue
+            asked_at[line["call_id"], request["response_id"]] = time.perf_counter()
+            await responses.start(request)
+        for responses in managers.values():
+            if responses.task is not None:
+                await responses.task
+            if responses.speculation is not None:
+                await responses.speculation.cancel("abandoned")
+
+        first_frames = []
+        for (call_id, response_id), asked in asked_at.items():
+            websocket = websockets[call_id]
+            sent = zip(websocket.sent_at, websocket.events)
+            first_frames.append(next(at for at, event in sent if event["response_id"] == response_id) - asked)
+        report[f"{label}_first_frame_p50_ms"] = ms(percentile(first_frames, 0.5))
+        report[f"{label}_first_frame_p99_ms"] = ms(percentile(first_frames, 0.99))
+    report["responses"] = len(asked_at)
+    report["speculations"] = metrics.speculations_total.get("started") - started_before
+    report["speculation_hits"] = metrics.speculations_total.get("hit") - hits_before
+    report["speculation_misses"] = metrics.speculations_total.get("miss") - misses_before
+    return report, report["speculative_first_frame_p50_ms"] < report["plain_first_frame_p50_ms"]
+
+
+@benchmark(FAKE_LLM_TTFT="0.01", FAKE_LLM_TOKEN_RATE="2000", FAKE_LLM_JITTER="0")
+async def context(args):
+    # prompt size over a synthetic 300-turn interview with background summarization between
+    # turns, against the size of the full transcript
+    import llm
+    from campaigns import Campaign
+
+    client = llm.LlmClient(Campaign.from_env())
+    system_tokens = client.context.count_tokens(client.campaign.system_messages)
+    transcript = [{"role": "agent", "content": "Welcome, Thank you for being here."}]
+    checkpoints = (10, 50, 100, 200, 300)
+    report = {}
+    largest = 0
+    for turn in range(1, checkpoints[-1] + 1):
+        transcript.append({"role": "user", "content": f"Answer {turn}: " + "we talked about rent and transport " * 8})
+        prompt = client.prepare_prompt({"interaction_type": "response_required", "transcript": transcript})
+        tokens = client.context.count_tokens(prompt)
+        largest = max(largest, tokens)
+        if turn in checkpoints:
+            report[f"turn_{turn}_prompt_tokens"] = tokens
+            report[f"turn_{turn}_transcript_tokens"] = client.context.count_tokens(transcript)
+        client.context.schedule(client.transcript_messages)
+        if client.context.task is not None:
+            await client.context.task  # the caller listening to the answer
+        transcript.append({"role": "agent", "content": f"Thanks. Question {turn + 1}, what about your plans?"})
+    report["max_prompt_tokens"] = largest
+    # the verbatim tail may reach the budget, plus what arrives while a summary is in flight
+    return report, largest <= system_tokens + 2 * llm.context_max_tokens
+
+
+class ScriptedWebSocket:
+    # plays one call's messages into the real websocket_handler; legacy=True redoes the
+    # per-message terminal clear and print the handler used to do before the logging pipeline
+    def __init__(self, messages, interval, legacy, terminal):
+        self.messages = messages
+        self.interval = interval
+        self.legacy = legacy
+        self.terminal = terminal
+        self.query_params = {}
+
+    async def accept(self):
+        pass
+
+    async def close(self, code=1000, reason=None):
+        pass
+
+    async def send_text(self, text):
+        pass
+
+    async def receive_text(self):
+        from fastapi import WebSocketDisconnect
+
+        if not self.messages:
+            raise WebSocketDisconnect()
+        await asyncio.sleep(self.interval)
+        message = self.messages.pop(0)
+        if self.legacy:
+            os.system("clear >/dev/null 2>&1")
+            print(message, file=self.terminal)
+        return message
+
+
+@benchmark(stub=False)
+async def loop_lag(args):
+    # event loop lag while 50 calls stream live transcript updates, with the old terminal
+    # clearing per message, with the queue logging pipeline, and with transcript dumps on
+    import logs
+    import server
+
+    listener = logs.setup_logging()
+    terminal = open(os.devnull, "w")
+    listener.handlers[0].setStream(terminal)
+    words = "The biggest challenge for me is finding a job that pays enough to cover rent and transport".split(" ")
+    transcripts = [[{"role": "user", "content": " ".join(words[:count])}] for count in range(1, len(words) + 1)]
+    updates = [json.dumps({"interaction_type": "update_only", "transcript": transcript}) for transcript in transcripts] * 3
+    report = {}
+    try:
+        for label, legacy, debug in (("legacy", True, False), ("queue", False, False), ("queue_debug", False, True)):
+            server.debug_transcripts = debug
+            logs.transcript_logger.setLevel("DEBUG" if debug else "NOTSET")
+            lags = []
+            done = asyncio.Event()
+
+            async def probe():
+                while not done.is_set():
+                    expected = time.perf_counter() + 0.005
+                    await asyncio.sleep(0.005)
+                    lags.append(max(time.perf_counter() - expected, 0))
+
+            probing = asyncio.create_task(probe())
+            await asyncio.gather(
+                *(
+                    server.websocket_handler(
+                        ScriptedWebSocket(list(updates), 0.05, legacy, terminal), f"bench-loop-lag-{index}"
+                    )
+                    for index in range(50)
+                )
+            )
+            done.set()
+            await probing
+            report[f"{label}_loop_lag_p50_ms"] = ms(percentile(lags, 0.5))
+            report[f"{label}_loop_lag_p99_ms"] = ms(percentile(lags, 0.99))
+    finally:
+        listener.stop()
+        terminal.close()
+    return report, report["queue_loop_lag_p99_ms"] < report["legacy_loop_lag_p99_ms"]
+
+
+async def run_benchmark(name):
+    function, stub, fake_llm_env = benchmarks[name]
+    llm_port = free_port()
+    env = app_environment(llm_port, **fake_llm_env)
+    process = start_fake_llm(llm_port, env) if stub else None
+    try:
+        if stub:
+            await wait_until_up(f"http://127.0.0.1:{llm_port}/v1/models")
+        os.environ.update(env)
+        import llm
+
+        try:
+            return await function(parse_args())
+        finally:
+            await llm.client_pool.close()
+            llm.endpoints.clear()
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Component benchmarks against the fake LLM.")
+    parser.add_argument("names", nargs="*", help=f"any of: {', '.join(benchmarks)} (default: all)")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--max-cancel-ms", type=float, default=50.0)
+    parser.add_argument("--trace", default=default_trace, help="recorded requests for the replay benchmark")
+    return parser.parse_args()
+
+
+def main():
+    sys.path.insert(0, repo_dir)
+    names = parse_args().names or list(benchmarks)
+    unknown = [name for name in names if name not in benchmarks]
+    if unknown:
+        print(f"Unknown benchmark(s): {', '.join(unknown)}", file=sys.stderr)
+        return 2
+    failed = []
+    for name in names:
+        started = time.perf_counter()
+        report, ok = asyncio.run(run_benchmark(name))
+        print(json.dumps({"benchmark": name, **report, "seconds": round(time.perf_counter() - started, 1), "ok": ok}))
+        if not ok:
+            failed.append(name)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
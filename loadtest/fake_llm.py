@@ -0,0 +1,110 @@
+import os
+import json
+import time
+import random
+
+import asyncio
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# OpenAI-compatible stand-in for load tests; point OPENAI_BASE_URL at http://host:port/v1.
+# Latency shape is set through env vars so the same stub can mimic a fast or a degraded provider.
+ttft = float(os.environ.get("FAKE_LLM_TTFT", "0.3"))  # seconds before the first token
+token_rate = float(os.environ.get("FAKE_LLM_TOKEN_RATE", "50"))  # tokens per second after that
+jitter = float(os.environ.get("FAKE_LLM_JITTER", "0.2"))  # +/- fraction applied to every delay
+response_text = os.environ.get(
+    "FAKE_LLM_TEXT",
+    "Thanks for sharing that, it really helps. Could you tell me a bit more about how that affects your day, "
+    "and what you usually do when it happens?",
+)
+
+app = FastAPI()
+open_streams = 0  # streaming responses still being written; drops when a client aborts
+
+
+def jittered(delay):
+    return max(delay * (1 + random.uniform(-jitter, jitter)), 0)
+
+
+def completion_chunk(model, delta, finish_reason=None):
+    return {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+
+
+@app.get("/v1/models")
+async def list_models():
+    return {"object": "list", "data": [{"id": "fake", "object": "model", "created": 0, "owned_by": "loadtest"}]}
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    model = body.get("model", "fake")
+    tokens = [word + " " for word in response_text.split(" ")]
+    usage = {
+        "prompt_tokens": sum(len(message["content"]) // 4 for message in body["messages"]),
+        "completion_tokens": len(tokens),
+        "total_tokens": 0,
+        "prompt_tokens_details": {"cached_tokens": 0},
+    }
+
+    if not body.get("stream"):
+        await asyncio.sleep(jittered(ttft + len(tokens) / token_rate))
+        content = "".join(tokens)
+        if body.get("response_format", {}).get("type") == "json_object":
+            # post-call analysis: one canned result per "### Transcript <n>" in the request
+            transcripts = body["messages"][-1]["content"].count("### Transcript ")
+            content = json.dumps(
+                {
+                    "results": [
+                        {"index": index, "answers": [], "profile_fit": {"verdict": "unclear", "reason": ""}, "summary": response_text}
+                        for index in range(transcripts)
+                    ]
+                }
+            )
+        return JSONResponse(
+            {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": usage,
+            }
+        )
+
+    async def events():
+        global open_streams
+        open_streams += 1
+        try:
+            async for event in stream_events():
+                yield event
+        finally:
+            open_streams -= 1
+
+    async def stream_events():
+        await asyncio.sleep(jittered(ttft))
+        yield f"data: {json.dumps(completion_chunk(model, {'role': 'assistant', 'content': ''}))}\n\n"
+        for token in tokens:
+            yield f"data: {json.dumps(completion_chunk(model, {'content': token}))}\n\n"
+            await asyncio.sleep(jittered(1 / token_rate))
+        yield f"data: {json.dumps(completion_chunk(model, {}, 'stop'))}\n\n"
+        if body.get("stream_options", {}).get("include_usage"):
+            chunk = completion_chunk(model, {})
+            chunk["choices"] = []
+            chunk["usage"] = usage
+            yield f"data: {json.dumps(chunk)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
@@ -0,0 +1,296 @@
+import os
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import subprocess
+
+import asyncio
+import httpx
+import websockets
+
+# Load test for one server worker: starts the fake LLM and the app on local ports, then
+# drives swarms of simulated voice-platform calls against /llm-websocket/{call_id}.
+#
+#   python loadtest/run.py                      # 10, 100 and 500 concurrent calls, compare to baseline
+#   python loadtest/run.py --update-baseline    # store this run as the new baseline
+#
+# Without a baseline file the run fails unless --no-baseline-ok is given.
+
+loadtest_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.dirname(loadtest_dir)
+default_baseline = os.path.join(loadtest_dir, "baseline.json")
+
+begin_utterance = "Welcome, Thank you for being here."
+user_utterances = [
+    "Yes I am ready, I am twenty two and I live in Sao Paulo with my family",
+    "The biggest challenge for me is finding a job that pays enough to cover rent and transport",
+    "I want to finish my degree and maybe open a small business in my neighbourhood one day",
+    "Mostly my friends and my older sister, they help me when things get difficult",
+]
+
+# metric -> True when a higher value is worse
+regression_directions = {
+    "first_token_p50_ms": True,
+    "first_token_p99_ms": True,
+    "loop_lag_p99_ms": True,
+    "responses_per_second": False,
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def app_environment(llm_port, **overrides):
+    # point the app at the fake LLM, with a default campaign for calls without ?campaign_id
+    env = dict(
+        os.environ,
+        OPENAI_BASE_URL=f"http://127.0.0.1:{llm_port}/v1",
+        OPENAI_API_KEY="loadtest",
+        OPENAI_ORGANIZATION_ID="loadtest",
+    )
+    for name, value in {
+        "INTERVIEW_LANG": "en-US",
+        "INTERVIEWEE_PROFILE": "young people aged 18 to 25 from Brazil",
+        "INTERVIEW_CONTEXT": "challenges and aspirations of young people",
+        "INTERVIEW_QUESTIONS": "1. What are your biggest challenges?\n2. What are your dreams?",
+        "AI_MODEL": "fake",
+        "LOG_LEVEL": "WARNING",
+    }.items():
+        env.setdefault(name, value)
+    env.update(overrides)
+    return env
+
+
+def start_fake_llm(port, env):
+    return start_process(
+        [sys.executable, "-m", "uvicorn", "--host", "127.0.0.1", "--log-level", "warning",
+         "--app-dir", loadtest_dir, "--port", str(port), "fake_llm:app"],
+        env,
+    )
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def parse_histogram(text, name):
+    buckets = []
+    for line in text.splitlines():
+        if line.startswith(name + "_bucket{"):
+            bound = line.split('le="', 1)[1].split('"', 1)[0]
+            buckets.append((float(bound), float(line.rsplit(" ", 1)[1])))
+    return buckets
+
+
+def histogram_quantile(before, after, q):
+    # quantile of the observations made between two scrapes, to bucket resolution
+    counts = [(bound, count - previous) for (bound, count), (_, previous) in zip(after, before)]
+    if not counts or counts[-1][1] == 0:
+        return 0.0
+    target = q * counts[-1][1]
+    for bound, count in counts[:-1]:
+        if count >= target:
+            return bound
+    return counts[-2][0]  # beyond the largest finite bucket; report that bound
+
+
+class Results:
+    def __init__(self):
+        self.first_token = []
+        self.responses = 0
+        self.frames = 0
+        self.errors = 0
+        self.rejected = 0  # turned away by the server's call limit (close code 1013)
+
+
+async def wait_until_up(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up")
+
+
+async def await_response(ws, response_id, results):
+    started = time.perf_counter()
+    first_token = None
+    content = ""
+    while True:
+        event = json.loads(await ws.recv())
+        if event["response_id"] != response_id:
+            continue
+        results.frames += 1
+        if first_token is None and (event["content"] or event["content_complete"]):
+            first_token = time.perf_counter() - started
+        content += event["content"]
+        if event["content_complete"]:
+            results.first_token.append(first_token)
+            results.responses += 1
+            return content
+
+
+async def simulate_call(url, call_id, turns, ramp, results):
+    await asyncio.sleep(random.uniform(0, ramp))
+    try:
+        async with websockets.connect(f"{url}/llm-websocket/{call_id}", max_size=None, open_timeout=60) as ws:
+            await ws.recv()  # begin message
+            transcript = [{"role": "agent", "content": begin_utterance}]
+            for response_id in range(1, turns + 1):
+                if response_id % 4 == 0:
+                    # the caller went quiet; the platform asks for a nudge
+                    interaction_type = "reminder_required"
+                else:
+                    interaction_type = "response_required"
+                    words = user_utterances[response_id % len(user_utterances)].split(" ")
+                    for count in range(3, len(words), 3):
+                        partial = {"role": "user", "content": " ".join(words[:count])}
+                        await ws.send(json.dumps({"interaction_type": "update_only", "transcript": [*transcript, partial]}))
+                        await asyncio.sleep(random.uniform(0.15, 0.3))
+                    transcript.append({"role": "user", "content": " ".join(words)})
+                await ws.send(
+                    json.dumps(
+                        {
+                            "interaction_type": interaction_type,
+                            "response_id": response_id,
+                            "transcript": transcript,
+                        }
+                    )
+                )
+                content = await await_response(ws, response_id, results)
+                transcript.append({"role": "agent", "content": content})
+    except websockets.ConnectionClosed as e:
+        if e.rcvd is not None and e.rcvd.code == 1013:
+            results.rejected += 1
+            return
+        results.errors += 1
+        print(f"call {call_id} failed: {e!r}", file=sys.stderr)
+    except Exception as e:
+        results.errors += 1
+        print(f"call {call_id} failed: {e!r}", file=sys.stderr)
+
+
+async def run_level(server_url, concurrency, turns, ramp):
+    results = Results()
+    async with httpx.AsyncClient() as client:
+        before = parse_histogram((await client.get(f"{server_url}/metrics")).text, "llm_event_loop_lag_seconds")
+        started = time.perf_counter()
+        ws_url = server_url.replace("http://", "ws://")
+        await asyncio.gather(
+            *(simulate_call(ws_url, f"load-{concurrency}-{index}", turns, ramp, results) for index in range(concurrency))
+        )
+        elapsed = time.perf_counter() - started
+        after = parse_histogram((await client.get(f"{server_url}/metrics")).text, "llm_event_loop_lag_seconds")
+
+    def ms(value):
+        return round(value * 1000, 1) if value is not None else None
+
+    return {
+        "calls": concurrency,
+        "responses": results.responses,
+        "errors": results.errors,
+        "rejected": results.rejected,
+        "first_token_p50_ms": ms(percentile(results.first_token, 0.5)),
+        "first_token_p99_ms": ms(percentile(results.first_token, 0.99)),
+        "responses_per_second": round(results.responses / elapsed, 2),
+        "frames_per_second": round(results.frames / elapsed, 1),
+        "loop_lag_p99_ms": ms(histogram_quantile(before, after, 0.99)),
+    }
+
+
+def find_regressions(report, baseline, tolerance, slack_ms):
+    regressions = []
+    for level, measured in report.items():
+        expected = baseline.get(level)
+        if expected is None:
+            continue
+        if measured["errors"] > expected.get("errors", 0):
+            regressions.append(f"{level} calls: {measured['errors']} errors")
+        if measured.get("rejected", 0) > expected.get("rejected", 0):
+            regressions.append(f"{level} calls: {measured['rejected']} rejected by the call limit")
+        for metric, higher_is_worse in regression_directions.items():
+            value, reference = measured.get(metric), expected.get(metric)
+            if value is None or reference is None:
+                continue
+            if higher_is_worse and value > reference * (1 + tolerance) + slack_ms:
+                regressions.append(f"{level} calls: {metric} {value} > baseline {reference}")
+            if not higher_is_worse and value < reference * (1 - tolerance):
+                regressions.append(f"{level} calls: {metric} {value} < baseline {reference}")
+    return regressions
+
+
+def start_process(args, env):
+    return subprocess.Popen(args, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Load test the LLM websocket server.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--turns", type=int, default=4)
+    parser.add_argument("--ramp", type=float, default=2.0, help="spread call starts over this many seconds")
+    parser.add_argument("--server-url", help="test an already running server instead of starting one")
+    parser.add_argument("--baseline", default=default_baseline)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--no-baseline-ok", action="store_true", help="pass when there is no baseline to compare to")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative regression")
+    parser.add_argument("--slack-ms", type=float, default=10.0, help="allowed absolute latency regression")
+    args = parser.parse_args()
+
+    processes = []
+    server_url = args.server_url
+    try:
+        if server_url is None:
+            llm_port, server_port = free_port(), free_port()
+            # the worker's call and upstream limits must not cut the measured levels short;
+            # the fake LLM has no capacity to protect
+            limit = str(max(args.concurrency))
+            env = app_environment(llm_port, MAX_CONCURRENT_CALLS=limit, MAX_UPSTREAM_STREAMS=limit)
+            processes.append(start_fake_llm(llm_port, env))
+            await wait_until_up(f"http://127.0.0.1:{llm_port}/v1/models")
+            uvicorn = [sys.executable, "-m", "uvicorn", "--host", "127.0.0.1", "--log-level", "warning"]
+            processes.append(start_process([*uvicorn, "--app-dir", repo_dir, "--port", str(server_port), "server:app"], env))
+            server_url = f"http://127.0.0.1:{server_port}"
+            await wait_until_up(f"{server_url}/metrics")
+
+        report = {}
+        for concurrency in args.concurrency:
+            report[str(concurrency)] = await run_level(server_url, concurrency, args.turns, args.ramp)
+            print(json.dumps(report[str(concurrency)]))
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=4)
+            f.write("\n")
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        # without a comparison this run proves nothing; don't let CI pass silently
+        print(f"No baseline at {args.baseline}; run with --update-baseline first")
+        return 0 if args.no_baseline_ok else 1
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = find_regressions(report, baseline, args.tolerance, args.slack_ms)
+    for regression in regressions:
+        print(f"REGRESSION: {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,29 @@
+import os
+import queue
+import logging
+from logging.handlers import QueueHandler, QueueListener
+
+log_level = os.environ.get("LOG_LEVEL", "INFO").upper()
+# dump every incoming websocket message (live transcript updates included) on the "transcripts" logger
+debug_transcripts = os.environ.get("DEBUG_TRANSCRIPTS", "false").lower() == "true"
+
+# its own logger, so transcript dumps don't switch DEBUG on for openai, httpcore and the rest
+transcript_logger = logging.getLogger("transcripts")
+
+
+def setup_logging():
+    # QueueHandler.prepare still merges each record's message and arguments on the calling
+    # thread (the event loop); the line format and the write to stderr happen on the
+    # listener's background thread.
+    log_queue = queue.SimpleQueue()
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    root = logging.getLogger()
+    root.setLevel(log_level)
+    root.addHandler(QueueHandler(log_queue))
+    transcript_logger.setLevel(logging.DEBUG if debug_transcripts else logging.NOTSET)
+    # httpx logs every upstream request at INFO
+    logging.getLogger("httpx").setLevel(max(root.level, logging.WARNING))
+    listener = QueueListener(log_queue, handler, respect_handler_level=True)
+    listener.start()
+    return listener
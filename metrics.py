@@ -0,0 +1,321 @@
+import os
+import json
+import asyncio
+import time
+import logging
+from bisect import bisect_left
+
+# In-process Prometheus-style metrics. Each uvicorn worker keeps its own registry;
+# observations are a bisect plus a few integer increments so they are cheap enough to
+# record per token. With several workers behind one port a scrape lands on any of them,
+# so with METRICS_DIR set every worker also publishes a snapshot there and /metrics
+# serves the sum over all workers (gauges only over workers still running).
+
+latency_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+token_gap_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+count_buckets = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+lag_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+# how often the event loop lag probe wakes up
+loop_lag_interval = float(os.environ.get("LOOP_LAG_INTERVAL", "0.25"))
+
+# shared by the workers of one server; unset, /metrics serves only the worker it reaches
+metrics_dir = os.environ.get("METRICS_DIR", "")
+# how often a worker publishes its snapshot for the others to serve
+metrics_publish_interval = float(os.environ.get("METRICS_PUBLISH_INTERVAL", "1"))
+
+# log one JSON line per finished turn
+json_turn_logs = os.environ.get("METRICS_JSON_LOGS", "false").lower() == "true"
+
+logger = logging.getLogger(__name__)
+
+registry = []
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, documentation, buckets=latency_buckets):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        registry.append(self)
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self):
+        return {"counts": list(self.counts), "sum": self.sum, "count": self.count}
+
+    @staticmethod
+    def merge(snapshots):
+        return {
+            "counts": [sum(counts) for counts in zip(*(snapshot["counts"] for snapshot in snapshots))],
+            "sum": sum(snapshot["sum"] for snapshot in snapshots),
+            "count": sum(snapshot["count"] for snapshot in snapshots),
+        }
+
+    def render(self, snapshot=None):
+        snapshot = snapshot or self.snapshot()
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        cumulative = 0
+        for bound, count in zip(self.buckets, snapshot["counts"]):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {snapshot["count"]}')
+        lines.append(f"{self.name}_sum {snapshot['sum']}")
+        lines.append(f"{self.name}_count {snapshot['count']}")
+        return lines
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, documentation, label=None):
+        self.name = name
+        self.documentation = documentation
+        self.label = label
+        self.values = {}
+        registry.append(self)
+
+    def inc(self, label_value=None, amount=1):
+        self.values[label_value] = self.values.get(label_value, 0) + amount
+
+    def set(self, value, label_value=None):
+        self.values[label_value] = value
+
+    def get(self, label_value=None):
+        return self.values.get(label_value, 0)
+
+    def snapshot(self):
+        return list(self.values.items())  # pairs, since a label value may be None
+
+    @staticmethod
+    def merge(snapshots):
+        values = {}
+        for snapshot in snapshots:
+            for label_value, value in snapshot:
+                values[label_value] = values.get(label_value, 0) + value
+        return list(values.items())
+
+    def render(self, snapshot=None):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for label_value, value in self.snapshot() if snapshot is None else snapshot:
+            if label_value is None:
+                lines.append(f"{self.name} {value}")
+            else:
+                lines.append(f'{self.name}{{{self.label}="{label_value}"}} {value}')
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+
+prompt_ready_seconds = Histogram(
+    "llm_prompt_ready_seconds", "Time from receiving a response request to the prompt being built."
+)
+first_token_seconds = Histogram(
+    "llm_first_token_seconds", "Time from sending the completion request to the first upstream token."
+)
+inter_token_seconds = Histogram(
+    "llm_inter_token_seconds", "Gap between consecutive upstream tokens.", token_gap_buckets
+)
+stream_seconds = Histogram(
+    "llm_stream_seconds", "Time from sending the completion request to the end of the response."
+)
+frames_per_response = Histogram(
+    "llm_frames_per_response", "Websocket frames sent per response.", count_buckets
+)
+cancel_seconds = Histogram(
+    "llm_cancel_seconds", "Time from cancelling a superseded response to its task having stopped."
+)
+responses_total = Counter(
+    "llm_responses_total", "Responses by outcome.", "outcome"
+)
+tokens_total = Counter(
+    "llm_tokens_total", "Token usage reported by the provider.", "kind"
+)
+speculations_total = Counter(
+    "llm_speculations_total", "Speculative drafts by outcome.", "outcome"
+)
+speculation_saved_seconds = Counter(
+    "llm_speculation_saved_seconds_total", "Latency hidden by speculative drafts that were used."
+)
+active_calls = Gauge(
+    "llm_active_calls", "Calls currently connected to this worker."
+)
+rejected_calls_total = Counter(
+    "llm_rejected_calls_total", "Calls turned away because the worker was at its call limit."
+)
+upstream_streams = Gauge(
+    "llm_upstream_streams", "Upstream requests currently holding a slot."
+)
+upstream_queue_depth = Gauge(
+    "llm_upstream_queue_depth", "Upstream requests waiting for a slot.", "priority"
+)
+upstream_wait_seconds = Histogram(
+    "llm_upstream_wait_seconds", "Time an upstream request waited for a slot."
+)
+event_loop_lag_seconds = Histogram(
+    "llm_event_loop_lag_seconds", "How late the event loop lag probe woke up.", lag_buckets
+)
+
+
+async def monitor_event_loop_lag(interval=loop_lag_interval):
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        event_loop_lag_seconds.observe(max(loop.time() - expected, 0.0))
+
+
+def render_metrics():
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def snapshot():
+    # taken on the event loop, so the files and the merge can be handled in a thread
+    return {metric.name: metric.snapshot() for metric in registry}
+
+
+def worker_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def snapshot_paths():
+    for name in os.listdir(metrics_dir):
+        if name.endswith(".json"):
+            yield int(name[: -len(".json")]), os.path.join(metrics_dir, name)
+
+
+def prepare_metrics_dir():
+    # drops what workers of an earlier run left behind; counters restart like a process would
+    os.makedirs(metrics_dir, exist_ok=True)
+    for pid, path in snapshot_paths():
+        if not worker_running(pid):
+            os.remove(path)
+
+
+def publish_snapshot(state):
+    path = os.path.join(metrics_dir, f"{os.getpid()}.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(path + ".tmp", path)  # readers never see half a file
+
+
+def render_workers_metrics(own):
+    publish_snapshot(own)
+    snapshots = {}
+    for pid, path in snapshot_paths():
+        try:
+            with open(path) as f:
+                snapshots[pid] = json.load(f)
+        except (OSError, ValueError):
+            continue  # replaced or removed while we listed it
+    lines = []
+    for metric in registry:
+        states = [
+            state[metric.name]
+            for pid, state in snapshots.items()
+            # a gone worker's counts still happened; its gauges no longer describe anything
+            if metric.name in state and (metric.kind != "gauge" or worker_running(pid))
+        ]
+        lines.extend(metric.render(metric.merge(states)))
+    return "\n".join(lines) + "\n"
+
+
+async def scrape_metrics():
+    if not metrics_dir:
+        return render_metrics()
+    return await asyncio.to_thread(render_workers_metrics, snapshot())
+
+
+async def publish_metrics(interval=metrics_publish_interval):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(publish_snapshot, snapshot())
+        except OSError as e:
+            logger.warning("Could not publish metrics to %s: %s", metrics_dir, e)
+
+
+class TurnMetrics:
+    # Timings for one response; the hot-path methods only take a timestamp and a bisect.
+    def __init__(self, call_id, response_id):
+        self.call_id = call_id
+        self.response_id = response_id
+        self.received_at = time.perf_counter()
+        self.requested_at = None
+        self.first_token_at = None
+        self.last_token_at = None
+        self.endpoint = None
+        self.frames = 0
+        self.tokens = 0
+        self.usage = None
+
+    def prompt_ready(self):
+        self.requested_at = time.perf_counter()
+        prompt_ready_seconds.observe(self.requested_at - self.received_at)
+
+    def token(self):
+        now = time.perf_counter()
+        if self.first_token_at is None:
+            self.first_token_at = now
+            if self.requested_at is not None:
+                first_token_seconds.observe(now - self.requested_at)
+        else:
+            inter_token_seconds.observe(now - self.last_token_at)
+        self.last_token_at = now
+        self.tokens += 1
+
+    def record_usage(self, usage):
+        details = usage.prompt_tokens_details
+        cached_tokens = details.cached_tokens if details and details.cached_tokens else 0
+        self.usage = {
+            "prompt": usage.prompt_tokens,
+            "cached": cached_tokens,
+            "completion": usage.completion_tokens,
+        }
+        for kind, value in self.usage.items():
+            tokens_total.inc(kind, value)
+
+    def finish(self, outcome):
+        now = time.perf_counter()
+        responses_total.inc(outcome)
+        frames_per_response.observe(self.frames)
+        if self.requested_at is not None:
+            stream_seconds.observe(now - self.requested_at)
+        if json_turn_logs:
+            logger.info(json.dumps(self.summary(outcome, now)))
+
+    def summary(self, outcome, now):
+        def since_received(at):
+            return round(at - self.received_at, 6) if at is not None else None
+
+        return {
+            "call_id": self.call_id,
+            "response_id": self.response_id,
+            "outcome": outcome,
+            "endpoint": self.endpoint,
+            "prompt_ready": since_received(self.requested_at),
+            "first_token": since_received(self.first_token_at),
+            "total": since_received(now),
+            "tokens": self.tokens,
+            "frames": self.frames,
+            "usage": self.usage,
+        }
@@ -0,0 +1,212 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+from contextlib import closing
+
+import asyncio
+from dotenv import load_dotenv
+
+from campaigns import campaign_registry
+from llm import client_pool
+
+# Post-call analysis. The server only appends finished transcripts to a SQLite queue; a
+# separate worker process (`python postcall.py`) drains it in batches, so none of the
+# analysis runs on the live-call event loop. The container starts that worker next to the
+# server when POSTCALL_ENABLED=true (see the Dockerfile); elsewhere run it alongside the
+# server with the same POSTCALL_DB_PATH.
+
+postcall_enabled = os.environ.get("POSTCALL_ENABLED", "false").lower() == "true"
+postcall_db_path = os.environ.get("POSTCALL_DB_PATH", "postcall.sqlite3")
+postcall_model = os.environ.get("POSTCALL_MODEL")
+postcall_batch_size = int(os.environ.get("POSTCALL_BATCH_SIZE", "5"))
+postcall_concurrency = int(os.environ.get("POSTCALL_CONCURRENCY", "2"))
+postcall_requests_per_minute = float(os.environ.get("POSTCALL_REQUESTS_PER_MINUTE", "30"))
+postcall_max_attempts = int(os.environ.get("POSTCALL_MAX_ATTEMPTS", "3"))
+postcall_poll_interval = float(os.environ.get("POSTCALL_POLL_INTERVAL", "5"))
+postcall_retry_delay = float(os.environ.get("POSTCALL_RETRY_DELAY", "60"))
+# a batch still "processing" after this long is assumed lost with its worker and retried
+postcall_visibility_timeout = float(os.environ.get("POSTCALL_VISIBILITY_TIMEOUT", "600"))
+
+logger = logging.getLogger(__name__)
+
+analysis_prompt = """You analyse finished voice interviews for the research team. For every transcript you are given, return:
+- "index": the transcript's index,
+- "answers": for each question of the question list, an object with "question" and "answer" (the interviewee's answer in their own words, condensed; null if it was never answered),
+- "profile_fit": an object with "verdict" ("fit", "not_fit" or "unclear") and a one-sentence "reason", judged against the target demographic,
+- "summary": a short summary of the interview.
+Reply with a JSON object of the form {"results": [...]} with one entry per transcript, in English."""
+
+
+class PostCallQueue:
+    # Durable queue of finished call transcripts. Every method opens its own connection so
+    # it can be called from worker threads (asyncio.to_thread) and from several processes.
+    def __init__(self, path=postcall_db_path):
+        self.path = path
+        with closing(self.connect()) as db:
+            db.execute(
+                """CREATE TABLE IF NOT EXISTS transcripts (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    call_id TEXT NOT NULL,
+                    campaign_id TEXT,
+                    transcript TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    result TEXT,
+                    error TEXT,
+                    updated_at REAL NOT NULL
+                )"""
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS transcripts_status ON transcripts (status, updated_at)")
+
+    def connect(self):
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        return db
+
+    def put(self, call_id, campaign_id, transcript):
+        with closing(self.connect()) as db:
+            db.execute(
+                "INSERT INTO transcripts (call_id, campaign_id, transcript, updated_at) VALUES (?, ?, ?, ?)",
+                (call_id, campaign_id, json.dumps(transcript), time.time()),
+            )
+
+    def claim(self, limit):
+        now = time.time()
+        with closing(self.connect()) as db:
+            db.execute("BEGIN IMMEDIATE")
+            rows = db.execute(
+                """SELECT id, call_id, campaign_id, transcript FROM transcripts
+                   WHERE (status = 'pending' AND (attempts = 0 OR updated_at < ?))
+                      OR (status = 'processing' AND updated_at < ?)
+                   ORDER BY id LIMIT ?""",
+                (now - postcall_retry_delay, now - postcall_visibility_timeout, limit),
+            ).fetchall()
+            db.executemany(
+                "UPDATE transcripts SET status = 'processing', attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                [(now, row[0]) for row in rows],
+            )
+            db.execute("COMMIT")
+        return [
+            {"id": id, "call_id": call_id, "campaign_id": campaign_id, "transcript": json.loads(transcript)}
+            for id, call_id, campaign_id, transcript in rows
+        ]
+
+    def complete(self, id, result):
+        with closing(self.connect()) as db:
+            db.execute(
+                "UPDATE transcripts SET status = 'done', result = ?, error = NULL, updated_at = ? WHERE id = ?",
+                (json.dumps(result), time.time(), id),
+            )
+
+    def fail(self, id, error):
+        with closing(self.connect()) as db:
+            db.execute(
+                """UPDATE transcripts
+                   SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, error = ?, updated_at = ?
+                   WHERE id = ?""",
+                (postcall_max_attempts, error, time.time(), id),
+            )
+
+
+class RateLimiter:
+    # spaces requests evenly so a burst of queued calls never exceeds the per-minute budget
+    def __init__(self, per_minute):
+        self.interval = 60 / per_minute if per_minute > 0 else 0
+        self.next_at = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self.lock:
+            now = time.monotonic()
+            if self.next_at > now:
+                await asyncio.sleep(self.next_at - now)
+            self.next_at = max(now, self.next_at) + self.interval
+
+
+def format_transcript(transcript):
+    return "\n".join(
+        f"{'Interviewer' if utterance['role'] == 'agent' else 'Interviewee'}: {utterance['content']}"
+        for utterance in transcript
+    )
+
+
+class PostCallWorker:
+    def __init__(self, queue, client, campaigns):
+        self.queue = queue
+        self.client = client
+        self.campaigns = campaigns
+        self.semaphore = asyncio.Semaphore(postcall_concurrency)
+        self.limiter = RateLimiter(postcall_requests_per_minute)
+
+    async def run(self):
+        while True:
+            if not await self.run_once():
+                await asyncio.sleep(postcall_poll_interval)
+
+    async def run_once(self):
+        jobs = await asyncio.to_thread(self.queue.claim, postcall_batch_size * postcall_concurrency)
+        batches = {}
+        for job in jobs:
+            batches.setdefault(job["campaign_id"], []).append(job)
+        await asyncio.gather(
+            *(
+                self.process(campaign_id, campaign_jobs[start : start + postcall_batch_size])
+                for campaign_id, campaign_jobs in batches.items()
+                for start in range(0, len(campaign_jobs), postcall_batch_size)
+            )
+        )
+        return len(jobs)
+
+    async def process(self, campaign_id, jobs):
+        async with self.semaphore:
+            try:
+                campaign = self.campaigns.get(campaign_id)
+                await self.limiter.wait()
+                results = await self.analyse(campaign, jobs)
+            except Exception as e:
+                logger.warning("Post-call analysis failed for %d transcripts: %r", len(jobs), e)
+                for job in jobs:
+                    await asyncio.to_thread(self.queue.fail, job["id"], repr(e))
+                return
+            for index, job in enumerate(jobs):
+                result = results.get(index)
+                if result is None:
+                    await asyncio.to_thread(self.queue.fail, job["id"], "missing from batch result")
+                else:
+                    await asyncio.to_thread(self.queue.complete, job["id"], result)
+
+    async def analyse(self, campaign, jobs):
+        transcripts = "\n\n".join(
+            f"### Transcript {index}\n{format_transcript(job['transcript'])}" for index, job in enumerate(jobs)
+        )
+        response = await self.client.chat.completions.create(
+            model=postcall_model or campaign.model,
+            response_format={"type": "json_object"},
+            messages=[
+                {"role": "system", "content": analysis_prompt},
+                {
+                    "role": "user",
+                    "content": f"Interview context: {campaign.interview_context}\n"
+                    f"Target demographic: {campaign.interviewee_profile}\n"
+                    f"Question list:\n{campaign.interview_questions}\n\n{transcripts}",
+                },
+            ],
+        )
+        results = json.loads(response.choices[0].message.content)["results"]
+        return {result["index"]: result for result in results if isinstance(result.get("index"), int)}
+
+
+async def main():
+    worker = PostCallWorker(PostCallQueue(), client_pool.get(), campaign_registry)
+    try:
+        await worker.run()
+    finally:
+        await client_pool.close()
+
+
+if __name__ == "__main__":
+    load_dotenv(override=True)
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
+    asyncio.run(main())
@@ -0,0 +1,261 @@
+import os
+import time
+import heapq
+import logging
+import itertools
+
+import asyncio
+from contextlib import asynccontextmanager
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# fire a second request to the next endpoint when the first has produced no token by then
+hedge_delay = float(os.environ.get("LLM_HEDGE_DELAY", "1.5"))
+# an endpoint whose first-token EWMA is above this is tried after the healthy ones;
+# by default that is any endpoint that typically needs a hedge
+degraded_threshold = float(os.environ.get("LLM_DEGRADED_THRESHOLD", str(hedge_delay)))
+# after this long without a fresh observation a degraded endpoint gets another chance
+degraded_cooldown = float(os.environ.get("LLM_DEGRADED_COOLDOWN", "30"))
+ewma_alpha = float(os.environ.get("LLM_EWMA_ALPHA", "0.3"))
+# upstream completion requests one worker keeps open at once; the rest wait in priority order
+max_upstream_streams = int(os.environ.get("MAX_UPSTREAM_STREAMS", "64"))
+
+# lower goes first: the answer the caller is waiting for beats a reminder, which beats a guess,
+# which beats housekeeping (summaries, canned line generation) nobody is waiting on
+priorities = {"response": 0, "reminder": 1, "speculation": 2, "background": 3}
+
+hedged_requests_total = metrics.Counter(
+    "llm_hedged_requests_total", "Extra upstream requests fired because the first was slow or failed."
+)
+endpoint_wins_total = metrics.Counter(
+    "llm_endpoint_wins_total", "Responses served per upstream endpoint.", "endpoint"
+)
+endpoint_failures_total = metrics.Counter(
+    "llm_endpoint_failures_total", "Upstream requests that failed or timed out before a token.", "endpoint"
+)
+endpoint_first_token_ewma = metrics.Gauge(
+    "llm_endpoint_first_token_ewma_seconds", "Smoothed time to first token per upstream endpoint.", "endpoint"
+)
+
+
+class UpstreamSlots:
+    # A priority-ordered semaphore on upstream requests. A slot is held from sending the
+    # request until its stream is closed, so hedged attempts take one each.
+    def __init__(self, max_streams=max_upstream_streams):
+        self.max_streams = max_streams
+        self.free_streams = max_streams
+        self.waiters = []  # heap of (priority, seq, future)
+        self.seq = itertools.count()
+
+    @property
+    def saturated(self):
+        return self.free_streams <= 0
+
+    async def acquire(self, priority):
+        if self.free_streams > 0 and not self.waiters:
+            self.free_streams -= 1
+            metrics.upstream_streams.set(self.max_streams - self.free_streams)
+            return
+        started = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priorities[priority], next(self.seq), future))
+        metrics.upstream_queue_depth.inc(priority)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()  # handed a slot just as we were cancelled: pass it on
+            raise
+        finally:
+            metrics.upstream_queue_depth.inc(priority, -1)
+        metrics.upstream_wait_seconds.observe(time.perf_counter() - started)
+
+    def release(self):
+        while self.waiters:
+            _, _, future = heapq.heappop(self.waiters)
+            if not future.done():  # cancelled waiters are left in the heap and skipped here
+                future.set_result(None)  # the slot moves straight to the waiter
+                return
+        self.free_streams += 1
+        metrics.upstream_streams.set(self.max_streams - self.free_streams)
+
+    @asynccontextmanager
+    async def slot(self, priority):
+        # for one-shot requests; streams hold theirs through a SlotStream
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+upstream_slots = UpstreamSlots()
+
+
+class SlotStream:
+    # An upstream completion stream that gives its slot back when it is closed.
+    def __init__(self, stream, slots):
+        self.stream = stream
+        self.slots = slots
+
+    def __aiter__(self):
+        return self.stream.__aiter__()
+
+    async def close(self):
+        slots, self.slots = self.slots, None
+        try:
+            await self.stream.close()
+        finally:
+            if slots is not None:
+                slots.release()
+
+
+class Endpoint:
+    # One model on one provider, with a process-wide estimate of its time to first token.
+    # stream_usage and prompt_cache say whether the provider accepts OpenAI's stream_options
+    # and prompt_cache_key; other OpenAI-compatible servers may reject them.
+    def __init__(self, name, client, model, timeout, stream_usage=True, prompt_cache=True):
+        self.name = name
+        self.client = client
+        self.model = model
+        self.timeout = timeout
+        self.stream_usage = stream_usage
+        self.prompt_cache = prompt_cache
+        self.ewma = None
+        self.observed_at = 0.0
+
+    def request_options(self, prompt_cache_key=None):
+        options = {}
+        if self.stream_usage:
+            options["stream_options"] = {"include_usage": True}
+        if self.prompt_cache and prompt_cache_key:
+            options["extra_body"] = {"prompt_cache_key": prompt_cache_key}
+        return options
+
+    def observe(self, seconds):
+        self.ewma = seconds if self.ewma is None else ewma_alpha * seconds + (1 - ewma_alpha) * self.ewma
+        self.observed_at = time.monotonic()
+        endpoint_first_token_ewma.set(self.ewma, self.name)
+
+    @property
+    def degraded(self):
+        return (
+            self.ewma is not None
+            and self.ewma > degraded_threshold
+            and time.monotonic() - self.observed_at < degraded_cooldown
+        )
+
+
+class LlmRouter:
+    # Opens a completion stream on the first endpoint to produce a token. Endpoints are tried
+    # in configured order with degraded ones moved to the back; a slow or failing attempt
+    # triggers the next endpoint, and whichever attempt loses is cancelled and closed.
+    # Every attempt waits for its own upstream slot.
+    def __init__(self, endpoints, slots=None):
+        self.endpoints = endpoints
+        self.slots = slots if slots is not None else upstream_slots
+        self.closing = set()  # closes of unused streams, referenced until they finish
+
+    def ranked(self):
+        return sorted(self.endpoints, key=lambda endpoint: endpoint.degraded)
+
+    async def open(self, **kwargs):
+        candidates = self.ranked()
+        attempts = {}
+        started = {}
+        error = None
+
+        def launch():
+            endpoint = candidates[len(attempts)]
+            task = asyncio.create_task(self.attempt(endpoint, started, **kwargs))
+            attempts[task] = endpoint
+
+        def waited():
+            # the hedge delay runs from the latest attempt's request, not from its wait for a slot
+            latest = list(attempts)[-1]
+            return time.perf_counter() - started[latest] if latest in started else 0.0
+
+        launch()
+        pending = set(attempts)
+        try:
+            while pending:
+                can_hedge = len(attempts) < len(candidates)
+                done, pending = await asyncio.wait(
+                    pending,
+                    timeout=max(hedge_delay - waited(), 0.0) if can_hedge else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                winners = [task for task in done if task.exception() is None]
+                for task in winners[1:]:
+                    # two attempts produced a token at once; keep the first, close the other
+                    self.discard(task)
+                if winners:
+                    endpoint_wins_total.inc(attempts[winners[0]].name)
+                    for task in pending:
+                        if task not in started:
+                            continue  # still waiting for a slot; says nothing about the endpoint
+                        # lost the race: that endpoint is at least this slow right now
+                        endpoint = attempts[task]
+                        endpoint.observe(max(time.perf_counter() - started[task], endpoint.ewma or 0.0))
+                    return winners[0].result()
+                for task in done:
+                    error = task.exception()
+                    endpoint_failures_total.inc(attempts[task].name)
+                    logger.warning("LLM endpoint %s failed: %r", attempts[task].name, error)
+                if can_hedge and (not pending or not done and waited() >= hedge_delay):
+                    # they all failed, or nothing yet from the latest attempt in time; one still
+                    # queued for a slot is not slow, and a hedge would only queue too
+                    hedged_requests_total.inc()
+                    launch()
+                    pending.add(list(attempts)[-1])
+            raise error
+        finally:
+            for task in pending:
+                # one may already have its stream: open itself can be cancelled (a barge-in)
+                # in the same tick an attempt returns
+                task.cancel()
+                task.add_done_callback(self.discard)
+
+    def discard(self, task):
+        # an attempt that got a stream nobody will read: close it so its slot comes back
+        if task.cancelled() or task.exception() is not None:
+            return
+        closing = asyncio.create_task(task.result()[1].close())
+        self.closing.add(closing)
+        closing.add_done_callback(self.closing.discard)
+
+    async def attempt(self, endpoint, started_at, priority="response", prompt_cache_key=None, **kwargs):
+        # the endpoint is timed from the request, not from the wait for a slot
+        await self.slots.acquire(priority)
+        started = started_at[asyncio.current_task()] = time.perf_counter()
+        stream = None
+        try:
+            async with asyncio.timeout(endpoint.timeout):
+                stream = await endpoint.client.chat.completions.create(
+                    model=endpoint.model, **kwargs, **endpoint.request_options(prompt_cache_key)
+                )
+                chunks = stream.__aiter__()
+                buffered = []
+                async for chunk in chunks:
+                    buffered.append(chunk)
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        break
+        except asyncio.CancelledError:
+            # lost the race (observed by open) or the response was superseded (says nothing
+            # about the endpoint)
+            await self.abandon(stream)
+            raise
+        except BaseException:
+            endpoint.observe(endpoint.timeout)
+            await self.abandon(stream)
+            raise
+        endpoint.observe(time.perf_counter() - started)
+        return endpoint, SlotStream(stream, self.slots), chunks, buffered
+
+    async def abandon(self, stream):
+        if stream is None:
+            self.slots.release()
+        else:
+            await SlotStream(stream, self.slots).close()
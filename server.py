@@ -1,49 +1,440 @@
 import os
 import json
+import time
+import logging
 
 import asyncio
+from contextlib import aclosing, asynccontextmanager
 from dotenv import load_dotenv
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse
 
-from llm import LlmClient
+from callstate import call_state_sweep_interval, create_call_state_store
+from campaigns import campaign_registry
+import metrics
+from logs import debug_transcripts, setup_logging, transcript_logger
+from postcall import PostCallQueue, postcall_enabled
+from llm import LlmClient, client_pool, load_tokenizers, normalize_phrase
+from routing import upstream_slots
 
 load_dotenv(override=True)
 
-app = FastAPI()
+logger = logging.getLogger(__name__)
+
+# draft from live transcript updates while the user is still talking (costs extra tokens)
+speculative_drafting = os.environ.get("SPECULATIVE_DRAFTING", "false").lower() == "true"
+# how many characters the final user utterance may add to the speculated one and still be a hit
+speculation_max_extension = int(os.environ.get("SPECULATION_MAX_EXTENSION", "0"))
+# calls beyond this are turned away at connect time so the voice platform retries another worker
+max_concurrent_calls = int(os.environ.get("MAX_CONCURRENT_CALLS", "200"))
+
+
+class AdmissionController:
+    # Per-worker backpressure: a cap on connected calls and the set of in-flight drafting tasks
+    # so shutdown can stop them. Upstream requests wait for their slot in routing.upstream_slots.
+    def __init__(self, max_calls=max_concurrent_calls):
+        self.max_calls = max_calls
+        self.calls = 0
+        self.tasks = set()
+
+    def admit_call(self):
+        if 0 < self.max_calls <= self.calls:
+            metrics.rejected_calls_total.inc()
+            return False
+        self.calls += 1
+        metrics.active_calls.set(self.calls)
+        return True
+
+    def release_call(self):
+        self.calls -= 1
+        metrics.active_calls.set(self.calls)
+
+    def track(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def shutdown(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    log_listener = setup_logging()
+    lag_monitor = asyncio.create_task(metrics.monitor_event_loop_lag())
+    sweeper = asyncio.create_task(sweep_call_states())
+    publisher = None
+    if metrics.metrics_dir:
+        await asyncio.to_thread(metrics.prepare_metrics_dir)
+        publisher = asyncio.create_task(metrics.publish_metrics())
+    await client_pool.warm_up()
+    await asyncio.to_thread(load_tokenizers)
+    yield
+    await admission.shutdown()
+    await queue_abandoned_call_states()
+    lag_monitor.cancel()
+    sweeper.cancel()
+    if publisher is not None:
+        publisher.cancel()
+        await asyncio.to_thread(metrics.publish_snapshot, metrics.snapshot())  # this worker's final counts
+    await client_pool.close()
+    await call_states.close()
+    log_listener.stop()
+
+
+app = FastAPI(lifespan=lifespan)
+
+postcall_queue = PostCallQueue() if postcall_enabled else None
+call_states = create_call_state_store()
+admission = AdmissionController()
+
+
+async def queue_postcall(call_id, campaign_id, transcript):
+    if postcall_queue is None or not transcript:
+        return
+    # hand the finished interview to the post-call worker; sqlite I/O stays off the loop
+    try:
+        await asyncio.shield(asyncio.to_thread(postcall_queue.put, call_id, campaign_id, transcript))
+    except Exception as e:
+        logger.warning("Could not queue transcript of %s for post-call analysis: %s", call_id, e)
+
+
+async def sweep_expired_call_states():
+    # a call that dropped and never reconnected has ended; its transcript was kept in its state
+    for call_id, state in await call_states.expired():
+        await queue_postcall(call_id, state["campaign_id"], state.get("transcript"))
+
+
+async def queue_abandoned_call_states():
+    # with a per-worker store, a dropped call can't come back once this worker is gone
+    for call_id, state in await call_states.abandoned():
+        await queue_postcall(call_id, state["campaign_id"], state.get("transcript"))
+
+
+async def sweep_call_states():
+    while True:
+        await asyncio.sleep(call_state_sweep_interval)
+        try:
+            await sweep_expired_call_states()
+        except Exception as e:
+            logger.warning("Call state sweep failed: %s", e)
+
+
+@app.get("/metrics")
+async def metrics_handler():
+    return PlainTextResponse(await metrics.scrape_metrics(), media_type="text/plain; version=0.0.4")
+
+
+class Speculation:
+    # A draft started from a live transcript update. Its events are buffered, not sent,
+    # until the real response request confirms the user said what we drafted against.
+    def __init__(self, llm_client, request):
+        self.llm_client = llm_client
+        self.request = dict(request, response_id=None, interaction_type="response_required")
+        self.transcript_length = len(request["transcript"])
+        self.utterance = normalize_phrase(request["transcript"][-1]["content"])
+        self.events = []
+        self.updated = asyncio.Event()
+        self.done = False
+        self.error = None
+        self.started = time.perf_counter()
+        self.first_event_at = None
+        self.task = admission.track(self.run())
+        metrics.speculations_total.inc("started")
+
+    async def run(self):
+        try:
+            events = self.llm_client.draft_response(self.request, priority="speculation")
+            async with aclosing(events):
+                async for event in events:
+                    if self.first_event_at is None:
+                        self.first_event_at = time.perf_counter()
+                    self.events.append(event)
+                    self.updated.set()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self.updated.set()
+
+    def matches(self, request):
+        transcript = request["transcript"]
+        if (
+            request["interaction_type"] != "response_required"
+            or len(transcript) != self.transcript_length
+            or transcript[-1]["role"] != "user"
+        ):
+            return False
+        utterance = normalize_phrase(transcript[-1]["content"])
+        return (
+            utterance.startswith(self.utterance)
+            and len(utterance) - len(self.utterance) <= speculation_max_extension
+        )
+
+    def claim(self):
+        now = time.perf_counter()
+        metrics.speculations_total.inc("hit")
+        metrics.speculation_saved_seconds.inc(amount=min(self.first_event_at or now, now) - self.started)
+
+    async def replay(self):
+        index = 0
+        try:
+            while True:
+                while index < len(self.events):
+                    yield self.events[index]
+                    index += 1
+                if self.error is not None:
+                    raise self.error
+                if self.done:
+                    return
+                self.updated.clear()
+                await self.updated.wait()
+        finally:
+            if not self.done:
+                self.task.cancel()  # the claimed response was itself superseded
+
+    async def cancel(self, outcome):
+        # "miss": the response request did not match it; "superseded": a newer live update
+        # replaced it; "abandoned": the call went away first
+        metrics.speculations_total.inc(outcome)
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+
+
+async def replay_draft(request, content):
+    yield {
+        "response_id": request["response_id"],
+        "content": content,
+        "content_complete": True,
+        "end_call": False,
+    }
+
+
+async def resume_draft(request, partial, events):
+    # what was drafted before the socket dropped goes out at once; the model continues from there
+    yield {
+        "response_id": request["response_id"],
+        "content": partial,
+        "content_complete": False,
+        "end_call": False,
+    }
+    async with aclosing(events):
+        async for event in events:
+            yield event
+
+
+class ResponseManager:
+    def __init__(self, websocket, llm_client, call_id):
+        self.websocket = websocket
+        self.llm_client = llm_client
+        self.call_id = call_id
+        self.response_id = 0
+        self.task = None
+        self.speculation = None
+        self.cancel_latencies = []  # seconds from cancel request to drafting task fully stopped
+        # the latest response as sent so far, kept so a reconnect can pick it up
+        self.draft_response_id = None
+        self.draft_parts = []
+        self.draft_complete = False
+        self.transcript = None  # the platform's latest transcript, for post-call analysis
+        self.ended = False
+
+    def export_state(self):
+        return {
+            "campaign_id": self.llm_client.campaign.campaign_id,
+            "response_id": self.response_id,
+            "draft": {
+                "response_id": self.draft_response_id,
+                "content": "".join(self.draft_parts),
+                "complete": self.draft_complete,
+            },
+            "llm": self.llm_client.export_state(),
+            # kept so a call that never reconnects still reaches post-call analysis when it expires
+            "transcript": self.transcript if postcall_queue is not None else None,
+        }
+
+    def restore_state(self, state):
+        self.response_id = state["response_id"]
+        self.draft_response_id = state["draft"]["response_id"]
+        self.draft_parts = [state["draft"]["content"]]
+        self.draft_complete = state["draft"]["complete"]
+        self.llm_client.restore_state(state["llm"])
+        self.transcript = state.get("transcript")
+
+    async def save_state(self, forget=False):
+        try:
+            if forget:
+                await call_states.delete(self.call_id)
+            else:
+                await call_states.put(self.call_id, self.export_state())
+            return True
+        except Exception as e:
+            logger.warning("Could not save call state for %s: %s", self.call_id, e)
+            return False
+
+    async def start(self, request):
+        turn = metrics.TurnMetrics(self.call_id, request["response_id"])
+        self.response_id = request["response_id"]
+        await self.cancel()
+        speculation = self.speculation
+        self.speculation = None
+        # the platform re-asks for the response that was being sent when the socket dropped
+        repeated = request["response_id"] == self.draft_response_id
+        if repeated and self.draft_complete:
+            if speculation is not None:
+                await speculation.cancel("miss")
+            events = replay_draft(request, "".join(self.draft_parts))
+        elif speculation is not None and speculation.matches(request):
+            speculation.claim()
+            events = speculation.replay()
+        else:
+            if speculation is not None:
+                await speculation.cancel("miss")
+            partial = "".join(self.draft_parts) if repeated else ""
+            priority = "reminder" if request["interaction_type"] == "reminder_required" else "response"
+            events = self.llm_client.draft_response(request, turn, partial, priority)
+            if partial:
+                events = resume_draft(request, partial, events)
+        self.task = admission.track(self.stream_response(request, events, turn))
+
+    async def speculate(self, request):
+        transcript = request.get("transcript")
+        if not transcript or transcript[-1]["role"] != "user":
+            return
+        speculation = self.speculation
+        if (
+            speculation is not None
+            and speculation.transcript_length == len(transcript)
+            and speculation.utterance == normalize_phrase(transcript[-1]["content"])
+        ):
+            return  # already drafting against this utterance
+        if upstream_slots.saturated:
+            return  # no spare upstream capacity for guesses
+        if speculation is not None:
+            await speculation.cancel("superseded")
+        self.speculation = Speculation(self.llm_client, request)
+
+    async def cancel(self):
+        task = self.task
+        self.task = None
+        if task is None or task.done():
+            return
+        started = time.perf_counter()
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        self.cancel_latencies.append(time.perf_counter() - started)
+        metrics.cancel_seconds.observe(self.cancel_latencies[-1])
+
+    async def stream_response(self, request, events, turn):
+        outcome = "completed"
+        self.draft_response_id = request["response_id"]
+        self.draft_parts = []
+        self.draft_complete = False
+        try:
+            async with aclosing(events):
+                async for event in events:
+                    if request["response_id"] < self.response_id:
+                        outcome = "superseded"
+                        return  # new response needed, abondon this one
+                    if event["response_id"] != request["response_id"]:
+                        event = dict(event, response_id=request["response_id"])  # claimed speculation
+                    await self.websocket.send_text(json.dumps(event))
+                    self.draft_parts.append(event["content"])
+                    turn.frames += 1
+                    if event["end_call"]:
+                        outcome = "end_call"
+                        self.ended = True  # the platform may hang up before this task gets further
+                    if event["content_complete"]:
+                        self.draft_complete = True
+            # persisted after the last frame went out, so the store is never on the latency path
+            await self.save_state(forget=self.ended)
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        except Exception:
+            outcome = "error"
+            raise
+        finally:
+            turn.finish(outcome)
 
 
 @app.websocket("/llm-websocket/{call_id}")
 async def websocket_handler(websocket: WebSocket, call_id: str):
     await websocket.accept()
-    print(f"Handle llm ws for: {call_id}")
+    logger.info("Handle llm ws for: %s", call_id)
 
-    llm_client = LlmClient()
+    if not admission.admit_call():
+        logger.warning("LLM WebSocket rejected for %s: worker at %d calls", call_id, admission.calls)
+        await websocket.close(code=1013, reason="try again later")
+        return
+    try:
+        await handle_call(websocket, call_id)
+    finally:
+        admission.release_call()
+
+
+async def handle_call(websocket, call_id):
+
+    # one fleet serves many campaigns; the voice platform passes ?campaign_id=... on the socket url
+    try:
+        campaign = campaign_registry.get(websocket.query_params.get("campaign_id"))
+    except Exception as e:
+        logger.warning("LLM WebSocket rejected for %s: %s", call_id, e)
+        await websocket.close(code=1008, reason="unknown campaign")
+        return
+
+    llm_client = LlmClient(campaign)
+    responses = ResponseManager(websocket, llm_client, call_id)
 
-    response_id = 0
     first_event = llm_client.draft_begin_messsage()
+    try:
+        state = await call_states.get(call_id)
+    except Exception as e:
+        logger.warning("Could not load call state for %s: %s", call_id, e)
+        state = None
+    if state is not None and state["campaign_id"] == campaign.campaign_id:
+        # a reconnect, possibly on another worker: carry on instead of greeting again
+        logger.info("Resuming call state for %s at response %s", call_id, state["response_id"])
+        responses.restore_state(state)
+        first_event["content"] = ""
     await websocket.send_text(json.dumps(first_event))
 
-    async def stream_response(request):
-        nonlocal response_id
-        for event in llm_client.draft_response(request):
-            await websocket.send_text(json.dumps(event))
-            if request["response_id"] < response_id:
-                return  # new response needed, abondon this one
-
     try:
         while True:
             message = await websocket.receive_text()
             request = json.loads(message)
-            os.system("cls" if os.name == "nt" else "clear")
-            # print(json.dumps(request, indent=4))
+            if debug_transcripts:
+                transcript_logger.debug("LLM WebSocket message for %s: %s", call_id, json.dumps(request, indent=4))
+            responses.transcript = request.get("transcript", responses.transcript)
 
             if "response_id" not in request:
-                continue  # no response needed, process live transcript update if needed
-            response_id = request["response_id"]
-            asyncio.create_task(stream_response(request))
+                # no response needed, but a live transcript update can warm up the next one
+                if speculative_drafting:
+                    await responses.speculate(request)
+                continue
+            await responses.start(request)
     except WebSocketDisconnect:
-        print(f"LLM WebSocket disconnected for {call_id}")
+        logger.info("LLM WebSocket disconnected for %s", call_id)
     except Exception as e:
-        print(f"LLM WebSocket error for {call_id}: {e}")
+        logger.exception("LLM WebSocket error for %s: %s", call_id, e)
     finally:
-        print(f"LLM WebSocket connection closed for {call_id}")
+        await responses.cancel()
+        if responses.speculation is not None:
+            await responses.speculation.cancel("abandoned")
+        if responses.ended:
+            await responses.save_state(forget=True)
+            await queue_postcall(call_id, campaign.campaign_id, responses.transcript)
+        elif not await responses.save_state():
+            # kept for a reconnect, the call reaches post-call analysis when its state expires;
+            # if it couldn't be kept, this is the last chance
+            await queue_postcall(call_id, campaign.campaign_id, responses.transcript)
+        logger.info("LLM WebSocket connection closed for %s", call_id)
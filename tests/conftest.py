@@ -0,0 +1,78 @@
+import os
+import sys
+import time
+import socket
+import asyncio
+import threading
+
+import pytest
+import uvicorn
+
+# Tests run against loadtest/fake_llm.py served on a local port; set the environment
+# before any app module is imported, since they read it at import time.
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [repo_dir, os.path.join(repo_dir, "loadtest")]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+fake_llm_port = free_port()
+os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{fake_llm_port}/v1"
+os.environ["OPENAI_API_KEY"] = "test"
+os.environ["OPENAI_ORGANIZATION_ID"] = "test"
+for name, value in {
+    "INTERVIEW_LANG": "en-US",
+    "INTERVIEWEE_PROFILE": "young people aged 18 to 25 from Brazil",
+    "INTERVIEW_CONTEXT": "challenges and aspirations of young people",
+    "INTERVIEW_QUESTIONS": "1. What are your biggest challenges?\n2. What are your dreams?",
+    "AI_MODEL": "fake",
+    "LOG_LEVEL": "WARNING",
+}.items():
+    os.environ.setdefault(name, value)
+
+import fake_llm  # noqa: E402
+import llm  # noqa: E402
+
+
+@pytest.fixture(scope="session", autouse=True)
+def fake_llm_server():
+    server = uvicorn.Server(uvicorn.Config(fake_llm.app, host="127.0.0.1", port=fake_llm_port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 10
+    while not server.started:
+        if time.monotonic() > deadline:
+            raise RuntimeError("fake LLM did not start")
+        time.sleep(0.05)
+    yield fake_llm
+    server.should_exit = True
+    thread.join()
+
+
+@pytest.fixture
+def fast_llm(monkeypatch):
+    # a quick, steady stub so tests don't wait on simulated provider latency
+    monkeypatch.setattr(fake_llm, "ttft", 0.05)
+    monkeypatch.setattr(fake_llm, "token_rate", 200)
+    monkeypatch.setattr(fake_llm, "jitter", 0)
+    return fake_llm
+
+
+@pytest.fixture
+def run():
+    # asyncio.run, closing the pooled clients inside the loop they were created on
+    def run(coroutine):
+        async def main():
+            try:
+                return await coroutine
+            finally:
+                await llm.client_pool.close()
+                llm.endpoints.clear()
+
+        return asyncio.run(main())
+
+    return run
@@ -0,0 +1,279 @@
+import json
+import time
+
+import asyncio
+import pytest
+from fastapi import WebSocketDisconnect
+from fastapi.testclient import TestClient
+
+import llm
+import server
+from campaigns import campaign_registry
+from callstate import MemoryCallStateStore, RedisCallStateStore
+
+
+class FakeRedis:
+    # the handful of redis.asyncio commands the store uses, with decode_responses=True semantics
+    def __init__(self):
+        self.values = {}  # key -> (expires_at or None, value)
+        self.sorted_sets = {}
+
+    async def get(self, key):
+        entry = self.values.get(key)
+        if entry is None or (entry[0] is not None and entry[0] <= time.time()):
+            return None
+        return entry[1]
+
+    async def set(self, key, value, ex=None):
+        assert ex is None or isinstance(ex, int) and ex > 0, "redis only takes whole positive seconds"
+        self.values[key] = (time.time() + ex if ex is not None else None, value)
+
+    async def delete(self, key):
+        return int(self.values.pop(key, None) is not None)
+
+    async def zadd(self, name, mapping):
+        self.sorted_sets.setdefault(name, {}).update(mapping)
+
+    async def zscore(self, name, member):
+        return self.sorted_sets.get(name, {}).get(member)
+
+    async def zrangebyscore(self, name, low, high):
+        members = self.sorted_sets.get(name, {})
+        return sorted((member for member, score in members.items() if low <= score <= high), key=members.get)
+
+    async def zrem(self, name, member):
+        return int(self.sorted_sets.get(name, {}).pop(member, None) is not None)
+
+    async def aclose(self):
+        pass
+
+
+def create_store(kind, ttl):
+    if kind == "redis":
+        return RedisCallStateStore(FakeRedis(), ttl)
+    return MemoryCallStateStore(ttl)
+
+
+stores = pytest.mark.parametrize("kind", ["memory", "redis"])
+
+
+@stores
+def test_state_roundtrip(kind):
+    async def main():
+        store = create_store(kind, ttl=60)
+        await store.put("call", {"response_id": 3, "draft": {"content": "Hello"}})
+        state = await store.get("call")
+        state["response_id"] = 4  # callers get a copy, never the stored state
+        return await store.get("call"), await store.get("other")
+
+    state, missing = asyncio.run(main())
+
+    assert state == {"response_id": 3, "draft": {"content": "Hello"}}
+    assert missing is None
+
+
+@stores
+def test_deleted_state_never_expires(kind):
+    async def main():
+        store = create_store(kind, ttl=0)
+        await store.put("call", {"response_id": 1})
+        await store.delete("call")
+        await asyncio.sleep(0.01)
+        return await store.get("call"), await store.expired()
+
+    assert asyncio.run(main()) == (None, [])
+
+
+@stores
+def test_expired_state_is_handed_out_once(kind):
+    async def main():
+        store = create_store(kind, ttl=0)
+        await store.put("call", {"response_id": 1})
+        await asyncio.sleep(0.01)
+        return await store.get("call"), await store.expired(), await store.expired()
+
+    state, first, second = asyncio.run(main())
+
+    assert state is None
+    assert first == [("call", {"response_id": 1})]
+    assert second == []
+
+
+@stores
+def test_put_refreshes_expiry(kind):
+    async def main():
+        store = create_store(kind, ttl=0.2)
+        await store.put("call", {"response_id": 1})
+        await asyncio.sleep(0.15)
+        await store.put("call", {"response_id": 2})
+        await asyncio.sleep(0.15)
+        return await store.get("call"), await store.expired()
+
+    assert asyncio.run(main()) == ({"response_id": 2}, [])
+
+
+def test_redis_expiry_is_claimed_by_one_worker():
+    async def main():
+        client = FakeRedis()
+        workers = [RedisCallStateStore(client, ttl=0) for _ in range(3)]
+        await workers[0].put("call", {"response_id": 1})
+        await asyncio.sleep(0.01)
+        return await asyncio.gather(*(worker.expired() for worker in workers))
+
+    claimed = [expired for expired in asyncio.run(main()) if expired]
+
+    assert claimed == [[("call", {"response_id": 1})]]
+
+
+class RecordingPostCallQueue:
+    def __init__(self):
+        self.items = []
+
+    def put(self, call_id, campaign_id, transcript):
+        self.items.append((call_id, campaign_id, transcript))
+
+
+@pytest.fixture
+def call_server(fast_llm, monkeypatch):
+    # the handler with a fresh state store and a post-call queue that only records
+    monkeypatch.setattr(fast_llm, "token_rate", 20)  # slow enough to drop a call mid-response
+    monkeypatch.setattr(server, "call_states", MemoryCallStateStore(ttl=60))
+    monkeypatch.setattr(server, "postcall_queue", RecordingPostCallQueue())
+    return server
+
+
+class CallWebSocket:
+    # plays requests into handle_call, each once the previous response is complete; the socket
+    # drops after the last one, or at its first frame with drop_mid_response
+    def __init__(self, requests, drop_mid_response=False):
+        self.requests = list(requests)
+        self.drop_mid_response = drop_mid_response
+        self.query_params = {}
+        self.events = []
+        self.waiting_for = None
+
+    async def send_text(self, text):
+        self.events.append(json.loads(text))
+
+    async def close(self, code=1000, reason=None):
+        pass
+
+    def responded(self):
+        for event in self.events:
+            if event["response_id"] == self.waiting_for:
+                if event["content_complete"] or (self.drop_mid_response and not self.requests):
+                    return True
+        return False
+
+    async def receive_text(self):
+        while self.waiting_for is not None and not self.responded():
+            await asyncio.sleep(0.005)
+        if not self.requests:
+            raise WebSocketDisconnect()
+        request = self.requests.pop(0)
+        self.waiting_for = request.get("response_id")
+        return json.dumps(request)
+
+    def content(self, response_id):
+        return "".join(event["content"] for event in self.events if event["response_id"] == response_id)
+
+
+transcript = [
+    {"role": "agent", "content": "Welcome, Thank you for being here."},
+    {"role": "user", "content": "Yes I am ready, I live in Sao Paulo with my family"},
+]
+
+
+default_campaign = campaign_registry.get(None).campaign_id
+
+
+def response_request(response_id, utterances=transcript):
+    return {"interaction_type": "response_required", "response_id": response_id, "transcript": utterances}
+
+
+def play_call(run, *websockets):
+    async def main():
+        for websocket in websockets:
+            await server.handle_call(websocket, "call-state-test")
+
+    run(main())
+
+
+def test_reconnect_replays_complete_response(call_server, run):
+    first = CallWebSocket([response_request(1)])
+    again = CallWebSocket([response_request(1)])
+
+    play_call(run, first, again)
+
+    assert again.events[0]["content"] == ""  # no second greeting
+    assert [event["content"] for event in again.events[1:]] == [first.content(1)]
+    assert call_server.postcall_queue.items == []  # the call may still come back
+
+
+def test_reconnect_resumes_partial_response(call_server, run, monkeypatch):
+    prompts = []
+    prepare_prompt = llm.LlmClient.prepare_prompt
+
+    def recording_prepare_prompt(self, request, partial=""):
+        prompts.append(prepare_prompt(self, request, partial))
+        return prompts[-1]
+
+    monkeypatch.setattr(llm.LlmClient, "prepare_prompt", recording_prepare_prompt)
+    dropped = CallWebSocket([response_request(1)], drop_mid_response=True)
+    resumed = CallWebSocket([response_request(1)])
+
+    play_call(run, dropped, resumed)
+
+    partial = dropped.content(1)
+    assert partial and not any(event["content_complete"] for event in dropped.events[1:])
+    assert resumed.events[1] == {"response_id": 1, "content": partial, "content_complete": False, "end_call": False}
+    assert resumed.events[-1]["content_complete"]
+    assert prompts[-1][-2:] == [{"role": "assistant", "content": partial}, llm.continuation_message]
+
+
+def test_end_call_queues_transcript_once(call_server, fast_llm, run, monkeypatch):
+    monkeypatch.setattr(fast_llm, "response_text", "Thank you for your time. The interview is over.")
+    websocket = CallWebSocket([response_request(1)])
+
+    play_call(run, websocket)
+
+    assert websocket.events[-1]["end_call"]
+    assert call_server.postcall_queue.items == [("call-state-test", default_campaign, transcript)]
+    assert run(call_server.call_states.get("call-state-test")) is None
+
+
+def test_expired_call_is_queued_by_the_sweep(call_server, run, monkeypatch):
+    monkeypatch.setattr(call_server, "call_states", MemoryCallStateStore(ttl=0))
+    websocket = CallWebSocket([response_request(1)])
+
+    play_call(run, websocket)
+    assert call_server.postcall_queue.items == []
+    time.sleep(0.01)
+    run(call_server.sweep_expired_call_states())
+    run(call_server.sweep_expired_call_states())
+
+    assert call_server.postcall_queue.items == [("call-state-test", default_campaign, transcript)]
+
+
+def test_memory_states_are_abandoned_at_shutdown():
+    async def main():
+        memory, redis = create_store("memory", ttl=60), create_store("redis", ttl=60)
+        for store in (memory, redis):
+            await store.put("call", {"response_id": 1})
+        # only the redis state can still be resumed, by another worker
+        return await memory.abandoned(), await memory.get("call"), await redis.abandoned(), await redis.get("call")
+
+    assert asyncio.run(main()) == ([("call", {"response_id": 1})], None, [], {"response_id": 1})
+
+
+def test_shutdown_queues_calls_left_in_the_memory_store(call_server, monkeypatch):
+    monkeypatch.setattr(llm, "endpoints", {})  # the app's shutdown closes the clients they hold
+    with TestClient(call_server.app) as client:
+        with client.websocket_connect("/llm-websocket/call-state-test") as websocket:
+            websocket.receive_json()  # greeting
+            websocket.send_text(json.dumps(response_request(1)))
+            while not websocket.receive_json()["content_complete"]:
+                pass
+        assert call_server.postcall_queue.items == []  # dropped, but it may still reconnect
+
+    assert call_server.postcall_queue.items == [("call-state-test", default_campaign, transcript)]
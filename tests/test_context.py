@@ -0,0 +1,66 @@
+import llm
+from campaigns import Campaign
+from llm import LlmClient
+
+
+def long_transcript(turns):
+    transcript = [{"role": "agent", "content": "Welcome, Thank you for being here."}]
+    for turn in range(turns):
+        transcript.append({"role": "user", "content": f"Answer {turn}: " + "we talked about rent and transport " * 10})
+        transcript.append({"role": "agent", "content": f"Thanks. Question {turn + 1}, what about your plans?"})
+    transcript.append({"role": "user", "content": "That is all I can say."})
+    return transcript
+
+
+class BrokenTiktoken:
+    # stands in for tiktoken when its BPE file can't be downloaded
+    def encoding_for_model(self, model):
+        raise ConnectionError("no network")
+
+    def get_encoding(self, name):
+        raise ConnectionError("no network")
+
+
+def test_tokenizer_failure_does_not_break_the_draft(fast_llm, monkeypatch, run):
+    monkeypatch.setattr(llm, "tiktoken", BrokenTiktoken())
+    llm.get_encoding.cache_clear()
+    llm.count_tokens.cache_clear()
+    client = LlmClient(Campaign.from_env())
+
+    async def main():
+        request = {"interaction_type": "response_required", "response_id": 1, "transcript": long_transcript(30)}
+        events = [event async for event in client.draft_response(request)]
+        await client.context.task
+        return events
+
+    try:
+        events = run(main())
+    finally:
+        llm.get_encoding.cache_clear()
+        llm.count_tokens.cache_clear()
+
+    assert events[-1]["content_complete"]
+    assert llm.count_tokens("x" * 40, "fake") == 11  # the length estimate
+
+
+def test_prompt_stays_bounded_on_long_interviews(fast_llm, monkeypatch, run):
+    monkeypatch.setattr(llm, "context_max_tokens", 1000)
+    monkeypatch.setattr(llm, "context_keep_messages", 6)
+    client = LlmClient(Campaign.from_env())
+    system_tokens = client.context.count_tokens(client.campaign.system_messages)
+
+    async def main():
+        sizes = []
+        transcript = long_transcript(120)
+        for end in range(3, len(transcript) + 1, 2):
+            prompt = client.prepare_prompt({"interaction_type": "response_required", "transcript": transcript[:end]})
+            sizes.append(client.context.count_tokens(prompt) - system_tokens)
+            client.context.schedule(client.transcript_messages)
+            if client.context.task is not None:
+                await client.context.task  # the caller listening to the answer
+        return sizes
+
+    sizes = run(main())
+    assert client.context.summarized > 0
+    assert max(sizes) <= 2 * llm.context_max_tokens
+    assert max(sizes[-30:]) <= max(sizes[40:70]) * 1.1
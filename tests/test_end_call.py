@@ -0,0 +1,95 @@
+import unicodedata
+
+import pytest
+
+from campaigns import Campaign, ending_translations
+from llm import EndCallMatcher, LlmClient
+
+
+def feed_all(matcher, deltas):
+    # index of the delta that confirmed the match, "finish" if only the end of stream did, else None
+    for index, delta in enumerate(deltas):
+        if matcher.feed(delta):
+            return index
+    return "finish" if matcher.finish() else None
+
+
+def split(text, size):
+    return [text[start : start + size] for start in range(0, len(text), size)]
+
+
+@pytest.mark.parametrize("language_code", sorted(ending_translations))
+@pytest.mark.parametrize("size", [1, 2, 3, 7])
+def test_phrase_split_across_deltas(language_code, size):
+    phrase = ending_translations[language_code]
+    deltas = split(f"Thank you for your time. {phrase}", size)
+    assert feed_all(EndCallMatcher(phrase), deltas) == len(deltas) - 1
+
+
+@pytest.mark.parametrize("language_code", sorted(ending_translations))
+def test_phrase_without_final_mark_ends_at_end_of_stream(language_code):
+    phrase = ending_translations[language_code].rstrip(".।。")
+    assert feed_all(EndCallMatcher(ending_translations[language_code]), split(phrase, 2)) == "finish"
+
+
+@pytest.mark.parametrize("language_code", sorted(ending_translations))
+def test_decomposed_unicode_matches(language_code):
+    phrase = ending_translations[language_code]
+    deltas = split(unicodedata.normalize("NFD", phrase), 1)
+    assert feed_all(EndCallMatcher(phrase), deltas) == len(deltas) - 1
+
+
+@pytest.mark.parametrize(
+    "deltas",
+    [
+        ["the INTERVIEW", "  is ", "over!"],
+        ["The inter", "view is over", "…"],
+        ["The interview, is over", "\n"],
+        ["The interview is over", " .", " Goodbye"],
+    ],
+)
+def test_case_whitespace_and_punctuation_variation(deltas):
+    assert feed_all(EndCallMatcher("The interview is over."), deltas) not in (None, "finish")
+
+
+@pytest.mark.parametrize(
+    "deltas",
+    [
+        ["Before the interview is over", ", one last", " question: how are you?"],
+        ["I hope the interview is over", "whelming for nobody."],
+        ["The interview is over", " soon, but first", " one more question."],
+    ],
+)
+def test_phrase_inside_a_sentence_does_not_match(deltas):
+    assert feed_all(EndCallMatcher("The interview is over."), deltas) is None
+
+
+def draft(run, request):
+    async def main():
+        return [event async for event in LlmClient(Campaign.from_env()).draft_response(request)]
+
+    return run(main())
+
+
+def response_request():
+    return {
+        "interaction_type": "response_required",
+        "response_id": 3,
+        "transcript": [{"role": "user", "content": "That was all from my side."}],
+    }
+
+
+def test_draft_ends_call_and_stops_on_phrase(fast_llm, monkeypatch, run):
+    monkeypatch.setattr(fast_llm, "response_text", "Thank you for your time. The interview is over. Goodbye and take care.")
+    events = draft(run, response_request())
+    assert events[-1]["end_call"] and events[-1]["content_complete"]
+    assert sum(event["end_call"] for event in events) == 1
+    assert "Goodbye" not in "".join(event["content"] for event in events)
+
+
+def test_draft_does_not_end_call_mid_sentence(fast_llm, monkeypatch, run):
+    text = "Before the interview is over, one last question: how are you?"
+    monkeypatch.setattr(fast_llm, "response_text", text)
+    events = draft(run, response_request())
+    assert not any(event["end_call"] for event in events)
+    assert "".join(event["content"] for event in events).strip() == text
@@ -0,0 +1,65 @@
+import os
+import json
+import subprocess
+import sys
+
+import asyncio
+
+import metrics
+
+
+def sample(text, line_start):
+    return next((float(line.rsplit(" ", 1)[1]) for line in text.splitlines() if line.startswith(line_start)), 0.0)
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def other_worker(counter, histogram, gauge):
+    # a snapshot as another worker would publish it
+    snapshot = metrics.snapshot()
+    snapshot[metrics.responses_total.name] = [["completed", counter]]
+    snapshot[metrics.stream_seconds.name] = {
+        "counts": [histogram] + [0] * len(metrics.stream_seconds.buckets),
+        "sum": 0.001 * histogram,
+        "count": histogram,
+    }
+    snapshot[metrics.active_calls.name] = [[None, gauge]]
+    return snapshot
+
+
+def test_scrape_sums_all_workers(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "metrics_dir", str(tmp_path))
+    for pid, counts in ((os.getppid(), (5, 2, 3)), (dead_pid(), (7, 1, 4))):
+        with open(tmp_path / f"{pid}.json", "w") as f:
+            json.dump(other_worker(*counts), f)
+    own = metrics.render_metrics()
+
+    text = asyncio.run(metrics.scrape_metrics())
+
+    def merged(line_start, others):
+        return sample(text, line_start) - sample(own, line_start) == others
+
+    assert merged('llm_responses_total{outcome="completed"}', 12)  # a gone worker's counts still count
+    assert merged('llm_stream_seconds_bucket{le="0.005"}', 3)
+    assert merged("llm_stream_seconds_count", 3)
+    assert merged("llm_active_calls", 3)  # but not its gauges
+    assert (tmp_path / f"{os.getpid()}.json").exists()
+
+
+def test_prepare_drops_snapshots_of_gone_workers(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "metrics_dir", str(tmp_path))
+    for pid in (os.getppid(), dead_pid()):
+        (tmp_path / f"{pid}.json").write_text("{}")
+
+    metrics.prepare_metrics_dir()
+
+    assert os.listdir(tmp_path) == [f"{os.getppid()}.json"]
+
+
+def test_without_a_metrics_dir_only_this_worker_is_served(monkeypatch):
+    monkeypatch.setattr(metrics, "metrics_dir", "")
+    assert asyncio.run(metrics.scrape_metrics()) == metrics.render_metrics()
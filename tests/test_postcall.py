@@ -0,0 +1,110 @@
+import json
+import time
+from types import SimpleNamespace
+from contextlib import closing
+
+import pytest
+
+import llm
+import postcall
+from campaigns import CampaignRegistry
+from postcall import PostCallQueue, PostCallWorker
+
+transcript = [
+    {"role": "agent", "content": "Welcome, Thank you for being here."},
+    {"role": "user", "content": "Yes I am ready, I live in Sao Paulo with my family"},
+]
+
+
+class RecordingClient:
+    # passes requests on to the fake LLM, keeping what each one was asked
+    def __init__(self, client):
+        self.client = client
+        self.requests = []
+        self.chat = SimpleNamespace(completions=self)
+
+    async def create(self, **kwargs):
+        self.requests.append(kwargs["messages"][-1]["content"])
+        return await self.client.chat.completions.create(**kwargs)
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    monkeypatch.setattr(postcall, "postcall_batch_size", 2)
+    monkeypatch.setattr(postcall, "postcall_concurrency", 2)
+    monkeypatch.setattr(postcall, "postcall_requests_per_minute", 0)
+    monkeypatch.setattr(postcall, "postcall_retry_delay", 0)
+    return PostCallQueue(str(tmp_path / "postcall.sqlite3"))
+
+
+@pytest.fixture
+def campaigns(tmp_path):
+    for campaign_id, context in (("jobs", "finding work"), ("housing", "finding a home")):
+        config = {
+            "language": "en-US",
+            "interviewee_profile": "young people aged 18 to 25 from Brazil",
+            "interview_context": context,
+            "interview_questions": ["What are your biggest challenges?"],
+        }
+        (tmp_path / f"{campaign_id}.json").write_text(json.dumps(config))
+    return CampaignRegistry(str(tmp_path))
+
+
+def rows(queue):
+    with closing(queue.connect()) as db:
+        return db.execute("SELECT call_id, status, attempts, result, error FROM transcripts ORDER BY id").fetchall()
+
+
+def drain(run, queue, campaigns):
+    async def main():
+        client = RecordingClient(llm.client_pool.get())
+        worker = PostCallWorker(queue, client, campaigns)
+        rounds = []
+        while claimed := await worker.run_once():
+            rounds.append(claimed)
+            time.sleep(0.01)  # past the (zero) retry delay
+        return client.requests, rounds
+
+    return run(main())
+
+
+def test_transcripts_are_analysed_in_batches_per_campaign(queue, campaigns, fast_llm, run):
+    for index in range(5):
+        queue.put(f"jobs-{index}", "jobs", transcript)
+    for index in range(2):
+        queue.put(f"housing-{index}", "housing", transcript)
+
+    requests, rounds = drain(run, queue, campaigns)
+
+    assert rounds == [4, 3]  # batch size times concurrency per round
+    assert sorted(request.count("### Transcript ") for request in requests) == [1, 2, 2, 2]
+    for request in requests:
+        assert ("finding work" in request) != ("finding a home" in request)  # never mixed
+    assert [(status, attempts) for _, status, attempts, _, _ in rows(queue)] == [("done", 1)] * 7
+    assert all(json.loads(result)["summary"] == fast_llm.response_text for _, _, _, result, _ in rows(queue))
+
+
+def test_failed_analysis_is_retried_then_given_up(queue, campaigns, fast_llm, run, monkeypatch):
+    monkeypatch.setattr(postcall, "postcall_max_attempts", 2)
+    queue.put("lost-campaign", "no-such-campaign", transcript)
+
+    requests, rounds = drain(run, queue, campaigns)
+
+    assert rounds == [1, 1]
+    assert requests == []
+    [(_, status, attempts, result, error)] = rows(queue)
+    assert (status, attempts, result) == ("failed", 2, None)
+    assert error
+
+
+def test_batch_stuck_in_processing_is_reclaimed(queue, campaigns, fast_llm, run, monkeypatch):
+    queue.put("orphaned", "jobs", transcript)
+    assert len(queue.claim(1)) == 1  # a worker took it and died
+
+    _, rounds = drain(run, queue, campaigns)
+    assert rounds == []  # still within the visibility timeout
+    monkeypatch.setattr(postcall, "postcall_visibility_timeout", 0)
+    _, rounds = drain(run, queue, campaigns)
+
+    assert rounds == [1]
+    assert [(status, attempts) for _, status, attempts, _, _ in rows(queue)] == [("done", 2)]
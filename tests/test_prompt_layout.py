@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+import campaigns
+from campaigns import Campaign
+from llm import LlmClient
+
+
+@pytest.fixture
+def prefix_layout(monkeypatch):
+    monkeypatch.setattr(campaigns, "prompt_layout", "prefix")
+
+
+def serialized(messages):
+    # how the messages go over the wire; the provider caches on the leading bytes
+    return json.dumps(messages, ensure_ascii=False)[:-1]
+
+
+def test_prefix_is_byte_identical_across_turns(prefix_layout):
+    client = LlmClient(Campaign.from_env())
+    transcript = [{"role": "agent", "content": "Welcome, Thank you for being here."}]
+    previous = None
+    for turn in range(1, 30):
+        transcript.append({"role": "user", "content": f"Partial answer {turn}"})
+        client.prepare_prompt({"interaction_type": "update_only", "transcript": transcript})
+        transcript[-1] = {"role": "user", "content": f"My full answer number {turn}, with détails."}
+        interaction_type = "reminder_required" if turn % 5 == 0 else "response_required"
+        prompt = serialized(client.prepare_prompt({"interaction_type": interaction_type, "transcript": transcript}))
+        if previous is not None:
+            assert prompt.startswith(previous)
+        if interaction_type == "response_required":
+            previous = prompt
+        transcript.append({"role": "agent", "content": f"Thanks. Question number {turn + 1}?"})
+
+
+def test_static_block_is_shared_across_campaigns(prefix_layout):
+    first = Campaign.from_env()
+    second = Campaign.from_dict(
+        "other",
+        {
+            "language": "ja-JP",
+            "interviewee_profile": "retirees in Osaka",
+            "interview_context": "daily routines",
+            "interview_questions": ["What does a usual morning look like?"],
+            "model": "other-model",
+        },
+    )
+    first_prompt = LlmClient(first).prepare_prompt({"interaction_type": "response_required", "transcript": []})
+    second_prompt = LlmClient(second).prepare_prompt({"interaction_type": "response_required", "transcript": []})
+    assert serialized(first_prompt[:1]) == serialized(second_prompt[:1])
+    assert first_prompt[1] != second_prompt[1]
+    assert "Osaka" not in serialized(second_prompt[:1])
@@ -0,0 +1,232 @@
+from types import SimpleNamespace
+
+import asyncio
+import pytest
+
+import routing
+from llm import client_pool
+from routing import Endpoint, LlmRouter, UpstreamSlots
+
+
+def chunk(content):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))], usage=None)
+
+
+class FakeStream:
+    def __init__(self, first_token_delay, gate=None):
+        self.first_token_delay = first_token_delay
+        self.gate = gate
+        self.closed = False
+
+    def __aiter__(self):
+        return self.chunks()
+
+    async def chunks(self):
+        yield chunk("")
+        await asyncio.sleep(self.first_token_delay)
+        if self.gate is not None:
+            await self.gate.wait()
+        yield chunk("Hello")
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeClient:
+    # an OpenAI-compatible client with injected latency: a delay to first token, or an error
+    def __init__(self, first_token_delay=0.0, error=None):
+        self.first_token_delay = first_token_delay
+        self.error = error
+        self.gate = None  # an asyncio.Event holding back the first token until set
+        self.requests = []
+        self.streams = []
+        self.chat = SimpleNamespace(completions=self)
+
+    async def create(self, **kwargs):
+        self.requests.append(kwargs)
+        if self.error is not None:
+            raise self.error
+        self.streams.append(FakeStream(self.first_token_delay, self.gate))
+        return self.streams[-1]
+
+
+def endpoint(name, timeout=5.0, **client_options):
+    return Endpoint(name, FakeClient(**client_options), f"model-{name}", timeout)
+
+
+@pytest.fixture(autouse=True)
+def quick_hedge(monkeypatch):
+    monkeypatch.setattr(routing, "hedge_delay", 0.05)
+    monkeypatch.setattr(routing, "degraded_threshold", 0.05)
+    monkeypatch.setattr(routing, "upstream_slots", UpstreamSlots())  # not left holding the worker's slots
+
+
+def test_fast_primary_is_not_hedged():
+    primary, fallback = endpoint("primary", first_token_delay=0.01), endpoint("fallback")
+    winner, stream, _, buffered = asyncio.run(LlmRouter([primary, fallback]).open(messages=[]))
+    assert winner is primary
+    assert buffered[-1].choices[0].delta.content == "Hello"
+    assert fallback.client.requests == []
+
+
+def test_slow_primary_is_hedged_and_the_loser_closed():
+    primary, fallback = endpoint("primary", first_token_delay=1.0), endpoint("fallback", first_token_delay=0.01)
+    before = routing.hedged_requests_total.get()
+    winner, _, _, _ = asyncio.run(LlmRouter([primary, fallback]).open(messages=[]))
+    assert winner is fallback
+    assert routing.hedged_requests_total.get() == before + 1
+    assert primary.client.streams[0].closed
+    assert primary.ewma >= 0.05  # the race loss counts against the primary
+    assert primary.degraded
+
+
+def test_failing_primary_falls_back_at_once():
+    primary = endpoint("primary", error=ConnectionError("refused"))
+    fallback = endpoint("fallback", first_token_delay=0.01)
+
+    async def main():
+        started = asyncio.get_running_loop().time()
+        result = await LlmRouter([primary, fallback]).open(messages=[])
+        return result[0], asyncio.get_running_loop().time() - started
+
+    winner, elapsed = asyncio.run(main())
+    assert winner is fallback
+    assert elapsed < 0.05  # no waiting for the hedge deadline
+    assert primary.ewma == primary.timeout
+
+
+def test_all_endpoints_failing_raises_the_last_error():
+    primary = endpoint("primary", error=ConnectionError("refused"))
+    fallback = endpoint("fallback", error=TimeoutError("slow"))
+    with pytest.raises(TimeoutError):
+        asyncio.run(LlmRouter([primary, fallback]).open(messages=[]))
+
+
+def test_first_token_timeout_triggers_fallback():
+    primary = endpoint("primary", timeout=0.02, first_token_delay=1.0)
+    fallback = endpoint("fallback", first_token_delay=0.01)
+    router = LlmRouter([primary, fallback])
+    winner, _, _, _ = asyncio.run(router.open(messages=[]))
+    assert winner is fallback
+
+
+def test_degraded_endpoint_is_tried_last():
+    primary, fallback = endpoint("primary"), endpoint("fallback")
+    primary.observe(1.0)
+    assert LlmRouter([primary, fallback]).ranked() == [fallback, primary]
+
+
+def test_superseded_draft_does_not_count_against_the_endpoint():
+    primary, fallback = endpoint("primary", first_token_delay=2.0), endpoint("fallback", first_token_delay=2.0)
+    primary.observe(0.3)
+    router = LlmRouter([primary, fallback])
+
+    async def main():
+        task = asyncio.create_task(router.open(messages=[]))
+        await asyncio.sleep(0.5)  # the caller barges in before any token
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert primary.ewma == 0.3
+    assert fallback.ewma is None
+    assert all(stream.closed for stream in primary.client.streams + fallback.client.streams)
+
+
+def test_request_options_are_per_endpoint():
+    primary = endpoint("primary", first_token_delay=1.0)
+    fallback = Endpoint("fallback", FakeClient(first_token_delay=0.01), "other", 5.0, stream_usage=False, prompt_cache=False)
+    asyncio.run(LlmRouter([primary, fallback]).open(messages=[], stream=True, prompt_cache_key="campaign"))
+    assert primary.client.requests[0]["stream_options"] == {"include_usage": True}
+    assert primary.client.requests[0]["extra_body"] == {"prompt_cache_key": "campaign"}
+    assert "stream_options" not in fallback.client.requests[0]
+    assert "extra_body" not in fallback.client.requests[0]
+    assert fallback.client.requests[0]["model"] == "other"
+
+
+def test_pool_keeps_one_client_per_api_key(run):
+    async def main():
+        first = client_pool.get("http://127.0.0.1:1/v1", "key-one")
+        second = client_pool.get("http://127.0.0.1:1/v1", "key-two")
+        assert first is not second
+        assert client_pool.get("http://127.0.0.1:1/v1", "key-one") is first
+        assert second.api_key == "key-two"
+
+    run(main())
+
+
+def test_each_hedged_stream_holds_a_slot_until_closed():
+    primary, fallback = endpoint("primary", first_token_delay=1.0), endpoint("fallback", first_token_delay=0.01)
+    slots = UpstreamSlots(2)
+
+    async def main():
+        _, stream, _, _ = await LlmRouter([primary, fallback], slots).open(messages=[])
+        await asyncio.sleep(0)  # the loser's cancellation closes its stream
+        held = slots.max_streams - slots.free_streams
+        await stream.close()
+        await stream.close()  # closing twice gives the slot back once
+        return held, slots.free_streams
+
+    assert asyncio.run(main()) == (1, 2)
+    assert primary.client.streams[0].closed
+
+
+def test_attempt_queued_for_a_slot_is_not_hedged():
+    primary, fallback = endpoint("primary", first_token_delay=0.01), endpoint("fallback")
+    slots = UpstreamSlots(1)
+    before = routing.hedged_requests_total.get()
+
+    async def main():
+        await slots.acquire("response")
+        task = asyncio.create_task(LlmRouter([primary, fallback], slots).open(messages=[]))
+        await asyncio.sleep(0.2)  # well past the hedge delay
+        slots.release()
+        return await task
+
+    winner, _, _, _ = asyncio.run(main())
+    assert winner is primary
+    assert routing.hedged_requests_total.get() == before
+    assert fallback.client.requests == []
+    assert primary.ewma < 0.05  # timed from the request, not from the wait
+
+
+def test_slots_go_to_the_most_urgent_waiter():
+    slots = UpstreamSlots(1)
+    order = []
+
+    async def wait(priority):
+        await slots.acquire(priority)
+        order.append(priority)
+        slots.release()
+
+    async def main():
+        await slots.acquire("response")
+        waiters = [asyncio.create_task(wait(priority)) for priority in ("background", "speculation", "reminder", "response")]
+        await asyncio.sleep(0)
+        slots.release()
+        await asyncio.gather(*waiters)
+
+    asyncio.run(main())
+    assert order == ["response", "reminder", "speculation", "background"]
+
+
+def test_stream_returned_as_the_draft_is_cancelled_is_closed():
+    primary = endpoint("primary")
+    slots = UpstreamSlots(2)
+
+    async def main():
+        primary.client.gate = asyncio.Event()
+        task = asyncio.create_task(LlmRouter([primary], slots).open(messages=[]))
+        while not primary.client.streams:
+            await asyncio.sleep(0)
+        primary.client.gate.set()  # the attempt returns its stream in the next tick...
+        task.cancel()  # ...just as the caller barges in
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        for _ in range(5):
+            await asyncio.sleep(0)
+        return slots.free_streams
+
+    assert asyncio.run(main()) == 2
+    assert primary.client.streams[0].closed
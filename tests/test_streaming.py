@@ -0,0 +1,112 @@
+import json
+import time
+
+import asyncio
+
+import metrics
+from campaigns import Campaign
+from llm import LlmClient
+from server import ResponseManager
+
+
+def response_request(response_id, utterance="Yes I am ready, I live in Sao Paulo with my family"):
+    return {
+        "interaction_type": "response_required",
+        "response_id": response_id,
+        "transcript": [
+            {"role": "agent", "content": "Welcome, Thank you for being here."},
+            {"role": "user", "content": utterance},
+        ],
+    }
+
+
+def test_concurrent_drafts_interleave(fast_llm, run):
+    calls = 10
+    campaign = Campaign.from_env()
+    received = []  # (call index, perf_counter) per event, in arrival order
+
+    async def draft(index):
+        async for event in LlmClient(campaign).draft_response(response_request(1)):
+            received.append((index, time.perf_counter(), event["content_complete"]))
+
+    async def main():
+        await draft(0)  # one call alone, as the serial reference
+        single = received[-1][1] - received[0][1]
+        received.clear()
+        started = time.perf_counter()
+        await asyncio.gather(*(draft(index) for index in range(calls)))
+        return single, time.perf_counter() - started
+
+    single, elapsed = run(main())
+
+    first_complete = next(position for position, (_, _, complete) in enumerate(received) if complete)
+    assert {index for index, _, _ in received[:first_complete]} == set(range(calls))
+    assert elapsed < single * calls / 2
+
+
+class RecordingWebSocket:
+    def __init__(self):
+        self.events = []
+
+    async def send_text(self, text):
+        self.events.append(json.loads(text))
+
+
+def test_superseded_response_is_cancelled(fast_llm, monkeypatch, run):
+    monkeypatch.setattr(fast_llm, "token_rate", 20)  # slow enough to still be streaming at the barge-in
+
+    async def main():
+        websocket = RecordingWebSocket()
+        responses = ResponseManager(websocket, LlmClient(Campaign.from_env()), "cancel-test")
+        await responses.start(response_request(1))
+        while not websocket.events:
+            await asyncio.sleep(0.005)
+        await responses.start(response_request(2, "Sorry, what was the question again?"))
+        cancelled_at = len(websocket.events)
+        # uncancelled, the first stream would keep going for over a second next to the second one
+        deadline = time.monotonic() + 0.5
+        while fast_llm.open_streams > 1 and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        upstream_open = fast_llm.open_streams
+        await responses.task
+        return websocket.events, cancelled_at, upstream_open, responses.cancel_latencies
+
+    events, cancelled_at, upstream_open, cancel_latencies = run(main())
+
+    assert upstream_open <= 1
+    assert [event["response_id"] for event in events[cancelled_at:]] == [2] * (len(events) - cancelled_at)
+    assert events[-1]["content_complete"]
+    assert len(cancel_latencies) == 1 and cancel_latencies[0] < 0.05
+
+
+def update(utterance):
+    return {
+        "interaction_type": "update_only",
+        "transcript": [
+            {"role": "agent", "content": "Welcome, Thank you for being here."},
+            {"role": "user", "content": utterance},
+        ],
+    }
+
+
+def test_speculation_outcomes(fast_llm, run):
+    outcomes = ("started", "hit", "miss", "superseded", "abandoned")
+    before = {outcome: metrics.speculations_total.get(outcome) for outcome in outcomes}
+
+    async def main():
+        websocket = RecordingWebSocket()
+        responses = ResponseManager(websocket, LlmClient(Campaign.from_env()), "speculation-test")
+        await responses.speculate(update("Yes I am"))
+        await responses.speculate(update("Yes I am ready"))  # the caller kept talking
+        await responses.start(response_request(1, "Yes I am ready"))
+        await responses.task
+        await responses.speculate(update("Mostly my"))
+        await responses.start(response_request(2, "Mostly my sister"))
+        await responses.task
+        await responses.speculate(update("Sorry"))
+        await responses.speculation.cancel("abandoned")  # hung up mid-sentence
+
+    run(main())
+
+    counts = {outcome: metrics.speculations_total.get(outcome) - before[outcome] for outcome in outcomes}
+    assert counts == {"started": 4, "hit": 1, "miss": 1, "superseded": 1, "abandoned": 1}